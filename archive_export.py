@@ -0,0 +1,173 @@
+import os
+import re
+import zlib
+import struct
+import zipfile
+from email.utils import formatdate
+
+ARCHIVE_FORMATS = ('mbox', 'zip')
+
+def _timestamp(email_data):
+    try:
+        return int(email_data.get('mail_timestamp') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def _header(value):
+    return re.sub(r'[\r\n]+', ' ', str(value or '')).strip()
+
+def _selection_line(selection):
+    return f"selection {selection}\n"
+
+# the selection an interrupted export left in its progress file, None when there is no (readable) one
+def _progress_selection(progress_path):
+    try:
+        with open(progress_path, 'rb') as f:
+            first = f.readline()
+    except OSError:
+        return None
+    if not first.startswith(b"selection ") or not first.endswith(b"\n"):
+        return None
+    return first[len(b"selection "):-1].decode('utf-8', 'replace')
+
+class MboxArchive:
+    # mbox is append-only, so every finished message is recorded in a progress file with the archive size after it,
+    # written once the message is flushed; reopening truncates any half-written tail (of either file) back to the
+    # last complete progress line and skips what is already in. The progress file starts with the selection being
+    # exported, an archive left by a different one is started over rather than continued
+    def __init__(self, path, selection):
+        self.path = path
+        self.progress_path = path + ".progress"
+        self.selection = selection
+        self.done = set()
+        self._file = None
+        self._progress = None
+
+    def open(self):
+        offset = 0
+        progress_size = 0
+        resume = os.path.exists(self.path) and _progress_selection(self.progress_path) == self.selection
+        if resume:
+            with open(self.progress_path, 'rb') as f:
+                progress_size = len(f.readline())
+                for line in f:
+                    parts = line.split()
+                    # a line cut short by an interrupted write ("103 1" of "103 1234") has no newline yet
+                    if not line.endswith(b"\n") or len(parts) != 2 or not parts[1].isdigit():
+                        break
+                    self.done.add(parts[0].decode('utf-8'))
+                    offset = int(parts[1])
+                    progress_size += len(line)
+            self._file = open(self.path, 'r+b')
+            self._file.truncate(offset)
+            self._file.seek(offset)
+        else:
+            self._file = open(self.path, 'wb')
+        self._progress = open(self.progress_path, 'r+' if resume else 'w', encoding='utf-8')
+        self._progress.truncate(progress_size) # drop the torn line so the next one starts clean
+        self._progress.seek(progress_size)
+        if not resume:
+            self._progress.write(_selection_line(self.selection))
+            self._progress.flush()
+        return self.done
+
+    def write(self, mail_id, email_data):
+        sender = _header(email_data.get('mail_from')) or 'unknown'
+        timestamp = _timestamp(email_data)
+        envelope_sender = sender.split()[-1].strip('<>') if sender else 'unknown'
+        body = str(email_data.get('mail_body', '')).replace('\r\n', '\n')
+        body = re.sub(r'^(>*From )', r'>\1', body, flags=re.MULTILINE)
+        message = (
+            f"From {envelope_sender} {formatdate(timestamp, usegmt=True)}\n"
+            f"From: {sender}\n"
+            f"Subject: {_header(email_data.get('mail_subject'))}\n"
+            f"Date: {formatdate(timestamp)}\n"
+            f"Message-ID: <{mail_id}@guerrillamail>\n"
+            "MIME-Version: 1.0\n"
+            "Content-Type: text/html; charset=utf-8\n"
+            "\n"
+            f"{body}\n\n"
+        )
+        self._file.write(message.encode('utf-8'))
+        self._file.flush()
+        self._progress.write(f"{mail_id} {self._file.tell()}\n")
+        self._progress.flush()
+        self.done.add(str(mail_id))
+
+    def close(self, complete=False):
+        if self._file is not None:
+            self._file.close()
+        if self._progress is not None:
+            self._progress.close()
+        if complete and os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
+
+def _salvage_zip(path):
+    # the complete entries of a zip whose writer died before the central directory went out. Each local header
+    # gets its crc and sizes rewritten once the entry is done, so an entry counts only if its data checks out and
+    # another zip record follows it; the one being written when the export stopped is left for the rerun
+    entries = []
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(zipfile.sizeFileHeader)
+            if len(header) < zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+                break
+            fields = struct.unpack(zipfile.structFileHeader, header)
+            flags, method, crc, compressed_size, name_length, extra_length = fields[3], fields[4], fields[7], fields[8], fields[10], fields[11]
+            name = f.read(name_length).decode('utf-8' if flags & 0x800 else 'cp437')
+            f.seek(extra_length, os.SEEK_CUR)
+            raw = f.read(compressed_size)
+            if len(raw) < compressed_size or flags & 0x08 or method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                break
+            try:
+                data = zlib.decompress(raw, -15) if method == zipfile.ZIP_DEFLATED else raw
+            except zlib.error:
+                break
+            following = f.read(4)
+            f.seek(-len(following), os.SEEK_CUR)
+            if zlib.crc32(data) != crc or following not in (zipfile.stringFileHeader, zipfile.stringCentralDir, zipfile.stringEndArchive):
+                break
+            entries.append((name, data))
+    return entries
+
+class ZipArchive:
+    # entries are streamed into the zip one at a time. An interrupted export of the same selection that closed
+    # cleanly is reopened in append mode and its entries are skipped; one that died before writing the central
+    # directory is rebuilt from the entries that made it to disk complete
+    def __init__(self, path, entry_name, selection):
+        self.path = path
+        self.progress_path = path + ".progress" # only holds the selection, the zip's own index says what is done
+        self.entry_name = entry_name
+        self.selection = selection
+        self.done = set()
+        self._zip = None
+
+    def open(self):
+        if os.path.exists(self.path) and _progress_selection(self.progress_path) == self.selection:
+            if not zipfile.is_zipfile(self.path): # ZipFile(path, 'a') would just start a second archive after the torn one
+                self._rebuild(_salvage_zip(self.path))
+            self._zip = zipfile.ZipFile(self.path, 'a', compression=zipfile.ZIP_DEFLATED)
+            self.done = {name.split('_', 1)[0] for name in self._zip.namelist()}
+            return self.done
+        with open(self.progress_path, 'w', encoding='utf-8') as f:
+            f.write(_selection_line(self.selection))
+        self._zip = zipfile.ZipFile(self.path, 'w', compression=zipfile.ZIP_DEFLATED)
+        return self.done
+
+    def _rebuild(self, entries):
+        tmp_path = self.path + ".rebuild"
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as rebuilt:
+            for name, data in entries:
+                rebuilt.writestr(name, data)
+        os.replace(tmp_path, self.path)
+
+    def write(self, mail_id, email_data):
+        with self._zip.open(self.entry_name(mail_id, email_data), 'w') as entry:
+            entry.write(str(email_data.get('mail_body', '')).encode('utf-8'))
+        self.done.add(str(mail_id))
+
+    def close(self, complete=False):
+        if self._zip is not None:
+            self._zip.close()
+        if complete and os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
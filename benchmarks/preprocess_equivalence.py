@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic import make_queries
+from preprocessing import Preprocessor, PREPROCESS_MODES, fast_tokenize
+from intent_classifier import IntentClassifier
+from question_answer import QAHandler
+from small_talk import SmallTalkHandler
+from run_benchmarks import DATASETS, INTENT_THRESHOLD, QA_THRESHOLD, SMALL_TALK_THRESHOLD
+
+LEMMA_SOURCES = [DATASETS[key] for key in ('intent', 'small_talk', 'qa')]
+
+def dataset_queries(key, extra):
+    import pandas as pd
+    source, column = DATASETS[key]
+    rows = pd.read_csv(source)[column].dropna().astype(str).tolist()
+    return rows + make_queries(source, column, extra, seed=11) # the shipped rows plus perturbed variants of them
+
+# texts the fast tokenizer keeps other tokens for than word_tokenize + isalnum(): every shipped row, plus each
+# row run on into the next as a second sentence, which word_tokenize splits apart before tokenizing. The
+# reference tokenizes those known sentences with NLTKWordTokenizer (what word_tokenize runs on each), so the
+# check needs no downloaded punkt data
+def tokenizer_mismatches():
+    import pandas as pd
+    from nltk.tokenize import NLTKWordTokenizer
+    tokenizer = NLTKWordTokenizer()
+    expected_tokens = lambda sentences: [w for sentence in sentences for w in tokenizer.tokenize(sentence) if w.isalnum()]
+    rows = [text.lower().strip() for source, column in LEMMA_SOURCES for text in pd.read_csv(source)[column].dropna().astype(str)]
+    sentences = [row if row.endswith(('.', '?', '!')) else row + '.' for row in rows if row]
+    cases = [[row] for row in rows] + [pair for pair in zip(sentences, sentences[1:])]
+    cases += [["hello.", "how are you?"], ["thanks.", "bye"], ["i said \"no.\"", "then left."]]
+    mismatches = []
+    for case in cases:
+        text = ' '.join(case)
+        expected = expected_tokens(case)
+        tokens = fast_tokenize(text)
+        if tokens != expected:
+            mismatches.append({'text': text, 'nltk': expected, 'fast': tokens})
+    return mismatches, len(cases)
+
+# everything the engine decides from one query, per dataset; small talk compares the matched row because
+# the reply itself is picked at random from that row's answers
+def outcomes(mode, queries, work_dir):
+    model_dir = os.path.join(work_dir, f"models_{mode}")
+    preprocessor = Preprocessor(mode=mode, model_dir=model_dir, lemma_sources=LEMMA_SOURCES)
+    started = time.perf_counter()
+    setup = {
+        'intent': IntentClassifier(DATASETS['intent'][0], preprocessor=preprocessor, model_dir=model_dir),
+        'qa': QAHandler(DATASETS['qa'][0], preprocessor=preprocessor, model_dir=model_dir),
+        'small_talk': SmallTalkHandler(DATASETS['small_talk'][0], preprocessor=preprocessor, model_dir=model_dir),
+    }
+    setup_s = time.perf_counter() - started
+    texts, results = {}, {}
+    preprocess_us = []
+    for key, key_queries in queries.items():
+        for query in key_queries:
+            started = time.perf_counter()
+            texts.setdefault(key, []).append(preprocessor.lemmatize_tokens(query))
+            preprocess_us.append((time.perf_counter() - started) * 1e6)
+    labels, scores = setup['intent'].classify_batch(queries['intent'], INTENT_THRESHOLD)
+    results['intent'] = [(f"{intent}/{subintent}", float(score)) for (intent, subintent), score in zip(labels, scores)]
+    answers, scores = setup['qa'].answer_batch(queries['qa'], QA_THRESHOLD)
+    results['qa'] = [(answer, float(score)) for answer, score in zip(answers, scores)]
+    results['small_talk'] = []
+    for query in queries['small_talk']:
+        matches = setup['small_talk'].candidates(query, k=1)
+        question, answer, score = matches[0] if matches else (None, None, 0.0)
+        results['small_talk'].append((question if score >= SMALL_TALK_THRESHOLD else None, float(score)))
+    timing = {'setup_s': round(setup_s, 3), 'preprocess_p50_us': round(float(np.percentile(preprocess_us, 50)), 1), 'preprocess_p95_us': round(float(np.percentile(preprocess_us, 95)), 1)}
+    return texts, results, timing
+
+def compare(queries, baseline, candidate, examples):
+    report = {'timing': {baseline['mode']: baseline['timing'], candidate['mode']: candidate['timing']}, 'datasets': {}}
+    for key, key_queries in queries.items():
+        token_diffs = sum(a != b for a, b in zip(baseline['texts'][key], candidate['texts'][key]))
+        differing = []
+        score_deltas = []
+        for query, (before, before_score), (after, after_score) in zip(key_queries, baseline['results'][key], candidate['results'][key]):
+            score_deltas.append(abs(before_score - after_score))
+            if before != after:
+                differing.append({'query': query, baseline['mode']: before, candidate['mode']: after})
+        report['datasets'][key] = {
+            'queries': len(key_queries),
+            'token_differences': token_diffs,
+            'outcome_differences': len(differing),
+            'agreement': round(1 - len(differing) / len(key_queries), 4) if key_queries else None,
+            'max_score_delta': round(max(score_deltas), 4) if score_deltas else None,
+            'examples': differing[:examples],
+        }
+    return report
+
+def print_report(report, baseline_mode, candidate_mode):
+    for mode, timing in report['timing'].items():
+        print(f"[EQUIV] {mode}: setup {timing['setup_s']} s, preprocess p50 {timing['preprocess_p50_us']} us, p95 {timing['preprocess_p95_us']} us")
+    for key, result in report['datasets'].items():
+        print(f"[EQUIV] {key}: {result['outcome_differences']}/{result['queries']} outcomes differ ({result['agreement']:.2%} agree), "
+              f"{result['token_differences']} token sequences differ, max score delta {result['max_score_delta']}")
+        for example in result['examples']:
+            print(f"    {example['query']!r}: {baseline_mode} {example[baseline_mode]!r} -> {candidate_mode} {example[candidate_mode]!r}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare what the preprocessing modes make of the shipped datasets: tokens, intents, QA answers and small talk matches")
+    parser.add_argument("--baseline", choices=PREPROCESS_MODES, default="nltk")
+    parser.add_argument("--candidate", choices=PREPROCESS_MODES, default="fast")
+    parser.add_argument("--extra-queries", type=int, default=500, help="perturbed queries per dataset on top of its own rows")
+    parser.add_argument("--examples", type=int, default=10, help="differing queries listed per dataset")
+    parser.add_argument("--work-dir", default=os.path.join(ROOT, "benchmarks", ".work", "equivalence"), help="compiled models (and the lemma table) for each mode")
+    parser.add_argument("--output", help="also write the report as json to this path")
+    parser.add_argument("--check-tokenizer", action="store_true", help="only compare the fast tokenizer with nltk's over the shipped rows and multi-sentence runs of them, exit 1 on any difference")
+    args = parser.parse_args()
+
+    if args.check_tokenizer:
+        mismatches, checked = tokenizer_mismatches()
+        for mismatch in mismatches[:args.examples]:
+            print(f"    {mismatch['text']!r}: nltk {mismatch['nltk']!r} -> fast {mismatch['fast']!r}")
+        print(f"[EQUIV] tokenizer: {len(mismatches)}/{checked} texts tokenize differently")
+        sys.exit(1 if mismatches else 0)
+
+    queries = {key: dataset_queries(key, args.extra_queries) for key in ('intent', 'qa', 'small_talk')}
+    runs = {}
+    for mode in (args.baseline, args.candidate):
+        texts, results, timing = outcomes(mode, queries, args.work_dir)
+        runs[mode] = {'mode': mode, 'texts': texts, 'results': results, 'timing': timing}
+    report = compare(queries, runs[args.baseline], runs[args.candidate], args.examples)
+    print_report(report, args.baseline, args.candidate)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"[EQUIV] Wrote the report to {args.output}")
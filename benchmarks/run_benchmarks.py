@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic import scale_csv, make_queries, make_inbox
+from preprocessing import Preprocessor
+from intent_classifier import IntentClassifier
+from question_answer import QAHandler
+from small_talk import SmallTalkHandler
+from guerrilla_mail import GuerrillaSession
+
+DATASETS = {
+    'intent': (os.path.join(ROOT, "datasets", "intents_data.csv"), 'Phrase'),
+    'qa': (os.path.join(ROOT, "datasets", "question_answer.csv"), 'Question'),
+    'small_talk': (os.path.join(ROOT, "datasets", "small_talk.csv"), 'Question'),
+}
+# same thresholds DialogueEngine uses
+INTENT_THRESHOLD = 0.2
+QA_THRESHOLD = 0.65
+SMALL_TALK_THRESHOLD = 0.4
+DEFAULT_SCALES = [1, 10, 100, 1000]
+DEFAULT_INBOX_SIZES = [10, 100, 1000, 10000]
+REGRESSION_RATIO = 1.2
+
+# make_args(i) builds the inputs for call i outside the timed region; memory is traced in a separate, shorter
+# pass because tracemalloc itself slows every allocation down
+def measure(name, params, call, make_args, iterations, warmup=5, memory_iterations=20):
+    for i in range(min(warmup, iterations)):
+        call(*make_args(i))
+    durations = np.empty(iterations)
+    for i in range(iterations):
+        args = make_args(i)
+        started = time.perf_counter_ns()
+        call(*args)
+        durations[i] = time.perf_counter_ns() - started
+    peak = 0
+    tracemalloc.start()
+    for i in range(min(memory_iterations, iterations)):
+        args = make_args(i)
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        call(*args)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+    durations /= 1000.0 # microseconds
+    result = {
+        'name': name,
+        'params': params,
+        'iterations': iterations,
+        'mean_us': round(float(durations.mean()), 3),
+        'p50_us': round(float(np.percentile(durations, 50)), 3),
+        'p95_us': round(float(np.percentile(durations, 95)), 3),
+        'p99_us': round(float(np.percentile(durations, 99)), 3),
+        'peak_kib': round(peak / 1024, 1),
+    }
+    print(f"[BENCH] {name} {json.dumps(params, sort_keys=True)}: p50 {result['p50_us']:.1f} us, p95 {result['p95_us']:.1f} us, p99 {result['p99_us']:.1f} us, peak {result['peak_kib']} KiB")
+    return result
+
+def timed_setup(factory):
+    tracemalloc.start()
+    started = time.perf_counter()
+    value = factory()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return value, {'setup_s': round(elapsed, 3), 'setup_peak_mib': round(peak / (1024 * 1024), 1)}
+
+def dataset_path(key, scale, work_dir):
+    source, column = DATASETS[key]
+    if scale == 1:
+        return source
+    name = os.path.splitext(os.path.basename(source))[0]
+    return scale_csv(source, scale, os.path.join(work_dir, "data", f"{name}_x{scale}.csv"), column, seed=scale)
+
+# every handler gets its own preprocessor with the memo off and every scale its own queries, so each timed call
+# (warm-up and memory passes included) pays for the full preprocessing at every scale
+def bench_nlp(scales, iterations, work_dir):
+    results = []
+    model_dir = os.path.join(work_dir, "models")
+    for scale in scales:
+        queries = {key: make_queries(DATASETS[key][0], DATASETS[key][1], iterations, seed=7 + scale) for key in DATASETS}
+        classifier, setup = timed_setup(lambda: IntentClassifier(dataset_path('intent', scale, work_dir), preprocessor=Preprocessor(memo_size=0), model_dir=model_dir))
+        if scale == scales[0]:
+            results.append(measure("_preprocess", {}, classifier._preprocess, lambda i: (queries['intent'][i],), iterations))
+        params = dict({'scale': scale, 'rows': len(classifier.phrases)}, **setup)
+        results.append(measure("IntentClassifier.classify", params, classifier.classify, lambda i: (queries['intent'][i], INTENT_THRESHOLD), iterations))
+        del classifier
+
+        qa, setup = timed_setup(lambda: QAHandler(dataset_path('qa', scale, work_dir), preprocessor=Preprocessor(memo_size=0), model_dir=model_dir))
+        params = dict({'scale': scale, 'rows': len(qa.questions), 'inverted_index': qa.index is not None}, **setup)
+        results.append(measure("QAHandler.get_QA_response", params, qa.get_QA_response, lambda i: (queries['qa'][i], QA_THRESHOLD), iterations))
+        del qa
+
+        small_talk, setup = timed_setup(lambda: SmallTalkHandler(dataset_path('small_talk', scale, work_dir), preprocessor=Preprocessor(memo_size=0), model_dir=model_dir))
+        params = dict({'scale': scale, 'rows': len(small_talk.questions)}, **setup)
+        results.append(measure("SmallTalkHandler.get_small_talk_response", params, small_talk.get_small_talk_response, lambda i: (queries['small_talk'][i], SMALL_TALK_THRESHOLD), iterations))
+        del small_talk
+    return results
+
+def new_session():
+    session = GuerrillaSession()
+    session.sid_token = "benchmarksession000000000"
+    session.email_addr = "benchmark@guerrillamailblock.com"
+    return session
+
+def bench_email(inbox_sizes, iterations):
+    results = []
+    for size in inbox_sizes:
+        inbox = make_inbox(size)
+        session = new_session()
+        session.inbox.merge(inbox)
+        for spec in dict.fromkeys(["all", "1-10", "1, 3, 5-9", f"1-{size}"]):
+            results.append(measure("GuerrillaSession._get_email_ids_from_indices", {'inbox': size, 'indices': spec}, session._get_email_ids_from_indices, lambda i: (spec,), iterations))
+
+        initial = {'list': inbox, 'count': str(size), 'sid_token': session.sid_token}
+        results.append(measure("GuerrillaSession._update_session_details", {'inbox': size, 'mode': 'initial'}, lambda s, r: s._update_session_details(r), lambda i: (new_session(), initial), iterations))
+
+        def preloaded(i):
+            target = new_session()
+            target._update_session_details(initial)
+            return target, {'list': make_inbox(1, start_id=1000 + size + i), 'count': str(size + 1), 'sid_token': target.sid_token}
+        results.append(measure("GuerrillaSession._update_session_details", {'inbox': size, 'mode': 'delta'}, lambda s, r: s._update_session_details(r), preloaded, min(iterations, 50)))
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old_path, new_path, ratio=REGRESSION_RATIO):
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = {(r['name'], json.dumps({k: v for k, v in r['params'].items() if not k.startswith('setup_')}, sort_keys=True)): r for r in json.load(f)['results']}
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)['results']
+    regressions = 0
+    for result in new:
+        key = (result['name'], json.dumps({k: v for k, v in result['params'].items() if not k.startswith('setup_')}, sort_keys=True))
+        before = old.get(key)
+        if before is None or not before['p50_us']:
+            continue
+        change = result['p50_us'] / before['p50_us']
+        flag = "REGRESSION" if change > ratio else ""
+        regressions += bool(flag)
+        print(f"{result['name']:<45} {key[1]:<60} p50 {before['p50_us']:>10.1f} -> {result['p50_us']:>10.1f} us ({change:5.2f}x) {flag}")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the NLP and email hot paths and write the results as json")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="dataset multiples to benchmark, 1 is the shipped csvs")
+    parser.add_argument("--inbox-sizes", type=int, nargs="+", default=DEFAULT_INBOX_SIZES)
+    parser.add_argument("--iterations", type=int, default=200, help="timed calls per benchmark")
+    parser.add_argument("--only", choices=["nlp", "email"], help="run just one group")
+    parser.add_argument("--work-dir", default=os.path.join(ROOT, "benchmarks", ".work"), help="where scaled datasets and their compiled models are kept between runs")
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results", "latest.json"))
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files instead of running, exits 1 if any p50 grew by more than 20%%")
+    args = parser.parse_args()
+    if args.compare:
+        raise SystemExit(1 if compare(*args.compare) else 0)
+
+    results = []
+    if args.only in (None, "nlp"):
+        results += bench_nlp(args.scales, args.iterations, args.work_dir)
+    if args.only in (None, "email"):
+        results += bench_email(args.inbox_sizes, args.iterations)
+    report = {
+        'meta': {'commit': git_commit(), 'python': platform.python_version(), 'platform': platform.platform(), 'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"), 'iterations': args.iterations},
+        'results': results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"[BENCH] Wrote {len(results)} results to {args.output}")
@@ -0,0 +1,69 @@
+import os
+import csv
+import time
+import random
+
+FILLER_WORDS = ["please", "now", "quickly", "again", "today", "maybe", "actually", "just", "really", "also"]
+
+# every source row is kept and joined by factor - 1 variants with shuffled, padded wording; about a third of the
+# variants carry a new token so the vocabulary grows with the data the way a larger real dataset's would
+def scale_csv(source_path, factor, output_path, text_column, seed=0):
+    if os.path.exists(output_path):
+        return output_path
+    rng = random.Random(seed)
+    with open(source_path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        rows = [row for row in reader if row.get(text_column)]
+    vocabulary = sorted({word for row in rows for word in row[text_column].split()})
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        serial = 0
+        for row in rows:
+            writer.writerow(row)
+            words = row[text_column].split()
+            for _ in range(factor - 1):
+                variant = list(words)
+                if len(variant) > 2:
+                    middle = variant[1:-1]
+                    rng.shuffle(middle)
+                    variant = variant[:1] + middle + variant[-1:]
+                variant.insert(rng.randrange(len(variant) + 1), rng.choice(FILLER_WORDS))
+                variant.append(rng.choice(vocabulary))
+                if rng.random() < 0.3:
+                    serial += 1
+                    variant.append(f"term{serial}")
+                writer.writerow(dict(row, **{text_column: " ".join(variant)}))
+    os.replace(tmp_path, output_path)
+    return output_path
+
+def make_queries(source_path, text_column, count, seed=0):
+    rng = random.Random(seed)
+    with open(source_path, newline='', encoding='utf-8') as f:
+        phrases = [row[text_column] for row in csv.DictReader(f) if row.get(text_column)]
+    queries = []
+    for i in range(count):
+        words = rng.choice(phrases).split()
+        if rng.random() < 0.5:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(FILLER_WORDS))
+        if rng.random() < 0.2:
+            words = ["something", "completely", "unrelated", "number", str(i)]
+        queries.append(f"{' '.join(words)} {i}") # distinct text per call within one run
+    return queries
+
+def make_inbox(size, start_id=1000, now=None):
+    now = int(now if now is not None else time.time())
+    return [{
+        'mail_id': str(start_id + i),
+        'mail_from': f"sender{i % 50}@example.com",
+        'mail_subject': f"Synthetic message {i}",
+        'mail_excerpt': f"Excerpt for message {i}",
+        'mail_timestamp': str(now - size + i),
+        'mail_date': time.strftime("%H:%M:%S", time.gmtime(now - size + i)),
+        'mail_read': '0',
+        'mail_size': '2048',
+        'att': '0',
+    } for i in range(size)]
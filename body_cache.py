@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from metrics import metrics
+
+BODY_CACHE_PATH = os.path.join("cache", "email_bodies.sqlite3")
+BODY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+class EmailBodyCache:
+    # fetched email bodies never change, so they are kept on disk keyed by (sid, mail_id) and evicted least recently used first
+    def __init__(self, path=BODY_CACHE_PATH, max_bytes=BODY_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS bodies ("
+            "sid TEXT NOT NULL, mail_id TEXT NOT NULL, payload TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL, "
+            "PRIMARY KEY (sid, mail_id))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS bodies_last_access ON bodies (last_access)")
+        self._db.commit()
+        self.total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM bodies").fetchone()[0]
+
+    def get(self, sid, mail_id):
+        with self._lock:
+            row = self._db.execute("SELECT payload FROM bodies WHERE sid = ? AND mail_id = ?", (sid, str(mail_id))).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE bodies SET last_access = ? WHERE sid = ? AND mail_id = ?", (time.time(), sid, str(mail_id)))
+            self._db.commit()
+        return json.loads(row[0])
+
+    def put(self, sid, mail_id, email_data):
+        payload = json.dumps(email_data)
+        size = len(payload.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._db.execute("SELECT size FROM bodies WHERE sid = ? AND mail_id = ?", (sid, str(mail_id))).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO bodies (sid, mail_id, payload, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (sid, str(mail_id), payload, size, time.time())
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            rows = self._db.execute("SELECT sid, mail_id, size FROM bodies ORDER BY last_access LIMIT 32").fetchall()
+            if not rows:
+                self.total_bytes = 0
+                return
+            for sid, mail_id, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM bodies WHERE sid = ? AND mail_id = ?", (sid, mail_id))
+                self.total_bytes -= size
+                self.evictions += 1
+
+    # mail_ids=None drops everything cached for the sid
+    def invalidate(self, sid, mail_ids=None):
+        with self._lock:
+            if mail_ids is None:
+                removed = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM bodies WHERE sid = ?", (sid,)).fetchone()[0]
+                self._db.execute("DELETE FROM bodies WHERE sid = ?", (sid,))
+            else:
+                removed = 0
+                for mail_id in mail_ids:
+                    row = self._db.execute("SELECT size FROM bodies WHERE sid = ? AND mail_id = ?", (sid, str(mail_id))).fetchone()
+                    if row:
+                        removed += row[0]
+                        self._db.execute("DELETE FROM bodies WHERE sid = ? AND mail_id = ?", (sid, str(mail_id)))
+            self.total_bytes -= removed
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM bodies").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': entries, 'bytes': self.total_bytes}
+
+_shared_body_cache = None
+_shared_lock = threading.Lock()
+
+def get_shared_body_cache():
+    global _shared_body_cache
+    with _shared_lock:
+        if _shared_body_cache is None:
+            _shared_body_cache = EmailBodyCache()
+            metrics.register_gauge("body_cache", _shared_body_cache.stats)
+    return _shared_body_cache
@@ -0,0 +1,296 @@
+import json
+import time
+import uuid
+import base64
+import signal
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from metrics import metrics
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC11B65"
+MAX_BODY_BYTES = 64 * 1024
+
+class ServerBusy(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+class UnknownSession(Exception):
+    pass
+
+class SessionSlot:
+    def __init__(self, chat_session, queue_size):
+        self.chat_session = chat_session
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.worker = None
+        self.last_active = time.monotonic()
+
+class ChatServer:
+    # classification runs on a small cpu pool, anything that reaches the mail api goes to a separate io pool,
+    # so a slow GuerrillaSession call only ever holds up its own session's queue
+    def __init__(self, engine, host="127.0.0.1", port=8765, cpu_workers=4, io_workers=16, max_pending=256, session_queue_size=8, session_idle_timeout=1800, max_sessions=1024):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.cpu_pool = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix="maila-cpu")
+        self.io_pool = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="maila-io")
+        self.max_pending = max_pending
+        self.session_queue_size = session_queue_size
+        self.session_idle_timeout = session_idle_timeout
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.pending = 0
+        self.draining = False
+        self.server = None
+
+    # session keys are only ever issued here (POST /sessions, a /chat without one, the ws handshake), so a client
+    # can't pick a key and land in someone else's session. Past max_sessions the idle ones are evicted first,
+    # and the new session is refused if that frees nothing
+    def _new_slot(self):
+        if len(self.sessions) >= self.max_sessions:
+            self._evict_idle_sessions()
+            if len(self.sessions) >= self.max_sessions:
+                raise ServerBusy("Too many open sessions, please retry later.", 503)
+        session_key = uuid.uuid4().hex
+        slot = SessionSlot(self.engine.new_session(session_key), self.session_queue_size)
+        slot.worker = asyncio.get_running_loop().create_task(self._session_worker(slot))
+        self.sessions[session_key] = slot
+        return slot
+
+    def _get_slot(self, session_key):
+        slot = self.sessions.get(session_key)
+        if slot is None:
+            raise UnknownSession("Unknown or expired session, start a new one with POST /sessions.")
+        slot.last_active = time.monotonic()
+        return slot
+
+    # one worker per session keeps its turns in the order they arrived
+    async def _session_worker(self, slot):
+        loop = asyncio.get_running_loop()
+        while True:
+            text, future = await slot.queue.get()
+            try:
+                turn = await loop.run_in_executor(self.cpu_pool, self.engine.prepare, slot.chat_session, text)
+                pool = self.io_pool if self.engine.needs_io(turn) else self.cpu_pool
+                result = await loop.run_in_executor(pool, self.engine.respond, slot.chat_session, turn)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.pending -= 1
+                slot.queue.task_done()
+
+    async def submit(self, session_key, text):
+        if self.draining or self.pending >= self.max_pending:
+            raise ServerBusy("Server is at capacity, please retry shortly.", 503)
+        slot = self._new_slot() if session_key is None else self._get_slot(session_key)
+        future = asyncio.get_running_loop().create_future()
+        try:
+            slot.queue.put_nowait((text, future))
+        except asyncio.QueueFull:
+            raise ServerBusy("Too many messages queued for this session, please wait for a reply.", 429)
+        self.pending += 1
+        response, action_data = await future
+        return {'session': slot.chat_session.session_key, 'response': response, 'action': action_data}
+
+    def _evict_idle_sessions(self):
+        cutoff = time.monotonic() - self.session_idle_timeout
+        for key, slot in list(self.sessions.items()):
+            if slot.last_active < cutoff and slot.queue.empty():
+                slot.worker.cancel()
+                del self.sessions[key]
+
+    async def _expire_idle_sessions(self):
+        while not self.draining:
+            await asyncio.sleep(min(60, self.session_idle_timeout))
+            self._evict_idle_sessions()
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length > MAX_BODY_BYTES:
+            raise ValueError("Request body too large.")
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), path, headers, body
+
+    def _write_response(self, writer, status, payload, extra_headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 429: 'Too Many Requests', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+        head = [f"HTTP/1.1 {status} {reasons.get(status, 'OK')}", "Content-Type: application/json", f"Content-Length: {len(body)}"]
+        head += extra_headers or []
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if path == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+                    if 'sec-websocket-key' not in headers:
+                        self._write_response(writer, 400, {'error': "Missing Sec-WebSocket-Key header."}, ["Connection: close"])
+                        break
+                    try:
+                        slot = self._new_slot()
+                    except ServerBusy as e:
+                        self._write_response(writer, e.status, {'error': str(e)}, ["Retry-After: 1", "Connection: close"])
+                        break
+                    await self._handle_websocket(reader, writer, headers, slot.chat_session.session_key)
+                    break
+                status, payload = await self._route(method, path, body)
+                extra = ["Retry-After: 1"] if status in (429, 503) else []
+                keep_alive = headers.get('connection', '').lower() != 'close' and not self.draining
+                extra.append("Connection: keep-alive" if keep_alive else "Connection: close")
+                self._write_response(writer, status, payload, extra)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:
+            self._write_response(writer, 400, {'error': str(e)}, ["Connection: close"])
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body):
+        if method == 'GET' and path == '/health':
+            return 200, {'status': 'draining' if self.draining else 'ok', 'sessions': len(self.sessions), 'pending': self.pending}
+        if method == 'GET' and path == '/stats' and self.engine.operator_commands: # same gate as the 'stats' command
+            return 200, metrics.snapshot()
+        if method == 'POST' and path == '/sessions':
+            try:
+                slot = self._new_slot()
+            except ServerBusy as e:
+                return e.status, {'error': str(e)}
+            return 200, {'session': slot.chat_session.session_key}
+        if method == 'POST' and path == '/chat':
+            try:
+                message = json.loads(body or b'{}')
+                text = str(message['text']).strip()
+            except (ValueError, KeyError, TypeError):
+                return 400, {'error': "Expected a json body with a 'text' field."}
+            if not text:
+                return 400, {'error': "Message text is empty."}
+            session_key = message.get('session')
+            if session_key is not None and not isinstance(session_key, str):
+                return 400, {'error': "The 'session' field must be a string."}
+            try:
+                return 200, await self.submit(session_key, text)
+            except ServerBusy as e:
+                return e.status, {'error': str(e)}
+            except UnknownSession as e:
+                return 404, {'error': str(e)}
+            except Exception as e:
+                print(f"[SERVER ERROR] Turn failed: {e}")
+                return 500, {'error': "An internal error occurred."}
+        return 404, {'error': f"No route for {method} {path}."}
+
+    async def _handle_websocket(self, reader, writer, headers, session_key):
+        accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write((
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode('latin-1'))
+        await writer.drain()
+        self._send_frame(writer, json.dumps({'session': session_key}))
+        while True:
+            opcode, payload = await self._read_frame(reader)
+            if opcode == 0x8: # close
+                writer.write(b'\x88\x00')
+                await writer.drain()
+                return
+            if opcode == 0x9: # ping
+                self._send_frame(writer, payload, opcode=0xA)
+                continue
+            if opcode != 0x1:
+                continue
+            try:
+                text = str(json.loads(payload.decode('utf-8'))['text']).strip()
+                reply = await self.submit(session_key, text)
+            except ServerBusy as e:
+                reply = {'session': session_key, 'error': str(e)}
+            except UnknownSession as e: # evicted while idle, the client has to reconnect for a new one
+                self._send_frame(writer, json.dumps({'session': session_key, 'error': str(e)}))
+                writer.write(b'\x88\x00')
+                await writer.drain()
+                return
+            except (ValueError, KeyError, TypeError):
+                reply = {'session': session_key, 'error': "Expected a json message with a 'text' field."}
+            self._send_frame(writer, json.dumps(reply))
+            await writer.drain()
+
+    async def _read_frame(self, reader):
+        first, second = await reader.readexactly(2)
+        opcode = first & 0x0F
+        length = second & 0x7F
+        if length == 126:
+            length = int.from_bytes(await reader.readexactly(2), 'big')
+        elif length == 127:
+            length = int.from_bytes(await reader.readexactly(8), 'big')
+        if length > MAX_BODY_BYTES:
+            raise ConnectionError("WebSocket frame too large.")
+        mask = await reader.readexactly(4) if second & 0x80 else None
+        payload = await reader.readexactly(length)
+        if mask:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return opcode, payload
+
+    def _send_frame(self, writer, data, opcode=0x1):
+        payload = data.encode('utf-8') if isinstance(data, str) else data
+        header = bytes([0x80 | opcode])
+        if len(payload) < 126:
+            header += bytes([len(payload)])
+        elif len(payload) < (1 << 16):
+            header += bytes([126]) + len(payload).to_bytes(2, 'big')
+        else:
+            header += bytes([127]) + len(payload).to_bytes(8, 'big')
+        writer.write(header + payload)
+
+    # stop accepting, let every queued turn finish (up to the timeout), then release the pools
+    async def drain(self, timeout=30):
+        self.draining = True
+        if self.server is not None:
+            self.server.close()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(slot.queue.join() for slot in list(self.sessions.values()))), timeout)
+        except asyncio.TimeoutError:
+            print(f"[SERVER] Drain timed out with {self.pending} turn(s) still pending.")
+        for slot in list(self.sessions.values()):
+            slot.worker.cancel()
+        self.cpu_pool.shutdown(wait=False)
+        self.io_pool.shutdown(wait=True)
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        expiry = loop.create_task(self._expire_idle_sessions())
+        routes = "POST /sessions, POST /chat, GET /health, GET /stats, ws /ws" if self.engine.operator_commands else "POST /sessions, POST /chat, GET /health, ws /ws"
+        print(f"[SERVER] Maila listening on http://{self.host}:{self.port} ({routes})")
+        await stop.wait()
+        print("[SERVER] Shutting down, draining in-flight turns...")
+        expiry.cancel()
+        await self.drain()
+        print("[SERVER] Stopped.")
+
+def run_server(engine, host, port, **kwargs):
+    asyncio.run(ChatServer(engine, host, port, **kwargs).serve())
@@ -0,0 +1,14 @@
+class ChatTranscript:
+    # append-only record of every message in the conversation; the chat window only renders a window onto its tail
+    def __init__(self):
+        self._entries = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def append(self, sender, name, message, timestamp):
+        self._entries.append((sender, name, message, timestamp))
+        return len(self._entries) - 1
+
+    def __getitem__(self, index):
+        return self._entries[index]
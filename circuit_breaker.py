@@ -0,0 +1,84 @@
+import time
+import threading
+from requests.exceptions import RequestException
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(RequestException):
+    # a RequestException so callers that already handle a failing mail api treat it the same way
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f"The {endpoint} endpoint is failing, not calling it for another {retry_after:.0f}s.")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    # opens after failure_threshold failures in a row and fails fast for reset_timeout seconds,
+    # then lets a single probe through; the probe's outcome closes it again or restarts the wait
+    def __init__(self, endpoint, failure_threshold=5, reset_timeout=30.0):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.rejected = 0
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            waited = time.monotonic() - self.opened_at
+            if self.state == OPEN and waited >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return
+            self.rejected += 1
+            retry_after = max(0.0, self.reset_timeout - waited)
+        raise CircuitOpenError(self.endpoint, retry_after)
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures, 'rejected': self.rejected, 'times_opened': self.times_opened}
+
+class CircuitBreakerRegistry:
+    # one breaker per api function, shared by every session since they all talk to the same service
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint):
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(endpoint, CircuitBreaker(endpoint, self.failure_threshold, self.reset_timeout))
+        return breaker
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {endpoint: breaker.stats() for endpoint, breaker in sorted(breakers.items())}
@@ -0,0 +1,47 @@
+import os
+import threading
+
+class DatasetWatcher:
+    # polls size and mtime rather than pulling in a file watching dependency. A change only fires once the files
+    # have looked the same for a whole poll, so a csv that is still being written isn't picked up half done
+    def __init__(self, paths, on_change, interval=2.0):
+        self.paths = list(paths)
+        self.on_change = on_change
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _signature(self):
+        signature = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                signature.append(None)
+        return signature
+
+    def _run(self):
+        seen = self._signature()
+        pending = None
+        while not self._stop.wait(self.interval):
+            current = self._signature()
+            if current != seen:
+                seen, pending = current, current
+            elif pending is not None:
+                try:
+                    if self.on_change() is not False: # False means busy (a reload already running), try again next poll
+                        pending = None
+                except Exception as e:
+                    pending = None
+                    print(f"[SYSTEM ERROR]: Dataset reload could not be started: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="dataset-watch", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
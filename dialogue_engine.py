@@ -0,0 +1,325 @@
+import time
+import threading
+from startup_report import StartupTimer, LazyHandler
+from preprocessing import get_shared_preprocessor
+from intent_classifier import IntentClassifier
+from identity import IdentityManagement
+from discoverability import Discoverability
+from email_states import EMAIL_TASK_STATES
+from metrics import metrics
+
+DATASET_PATHS = ["datasets/intents_data.csv", "datasets/small_talk.csv", "datasets/question_answer.csv"]
+IDENTITY_TASK_STATES = {"awaiting_name", "awaiting_name_confirm"}
+DISCOVER_TASK_STATES = {"general_help_loop", "capabilities_help"}
+
+# the heavier handlers (and requests, via transaction) are only imported when first built
+def build_small_talk_handler(preprocessor):
+    from small_talk import SmallTalkHandler
+    return SmallTalkHandler(preprocessor=preprocessor)
+
+def build_qa_handler(preprocessor):
+    from question_answer import QAHandler
+    return QAHandler(preprocessor=preprocessor)
+
+def build_email_handler():
+    from transaction import EmailHandler
+    return EmailHandler()
+
+class ChatSession:
+    __slots__ = ('session_key', 'chat_stack', 'username', 'session_id', 'email_address')
+
+    def __init__(self, session_key=None):
+        self.session_key = session_key
+        self.chat_stack = ["normal"]
+        self.username = None
+        self.session_id = None # guerrilla mail sid
+        self.email_address = None
+
+    @property
+    def current_state(self):
+        return self.chat_stack[-1]
+
+class ModelSet:
+    # the dataset backed models a turn is answered with. A reload builds a whole new set and swaps it in,
+    # so a turn that started on one set finishes on it even if a reload lands in between. The preprocessor the
+    # models were built with comes along, in fast mode its lemma table and memo have to match their vocabulary
+    __slots__ = ('intent_classifier', 'small_talk', 'qa', 'preprocessor', 'generation')
+
+    def __init__(self, intent_classifier, small_talk, qa, preprocessor, generation=0):
+        self.intent_classifier = intent_classifier
+        self.small_talk = small_talk
+        self.qa = qa
+        self.preprocessor = preprocessor
+        self.generation = generation
+
+    @property
+    def small_talk_handler(self):
+        return self.small_talk.get()
+
+    @property
+    def qa_handler(self):
+        return self.qa.get()
+
+class Turn:
+    __slots__ = ('query', 'current_state', 'models', 'processed_query', 'intent', 'subintent', 'score', 'response', 'action_data')
+
+    def __init__(self, query, current_state, models):
+        self.query = query
+        self.current_state = current_state
+        self.models = models
+        self.processed_query = None
+        self.intent = None
+        self.subintent = None
+        self.score = 0.0
+        self.response = None # already set when a universal command answered the turn
+        self.action_data = None
+
+class DialogueEngine:
+    # owns the models and handlers, shared by every ChatSession; all per-conversation state lives on the session
+    # operator_commands allows 'stats' and 'reload'; the server turns them off for remote users unless asked to
+    def __init__(self, lazy=False, timer=None, unified_index=False, operator_commands=True):
+        self.timer = timer if timer is not None else StartupTimer()
+        self.unified_index = unified_index
+        self.operator_commands = operator_commands
+        self._email_handler = LazyHandler("email_handler", build_email_handler, self.timer)
+        self.identity_handler = IdentityManagement()
+        self.discoverability_handler = Discoverability()
+        self.on_reload = None # called with last_reload from the reload thread once a reload finishes
+        self.reloading = False
+        self.last_reload = None
+        self._reload_lock = threading.Lock()
+        self.models = self._build_models(get_shared_preprocessor(), self.timer)
+        metrics.register_gauge("models", self.model_stats)
+        if not lazy:
+            for handler in self.lazy_handlers():
+                handler.get()
+
+    def _build_models(self, preprocessor, timer=None, generation=0):
+        started = time.perf_counter()
+        if self.unified_index: # the unified index answers small talk and QA itself
+            from unified_index import UnifiedIndex
+            intent_classifier = UnifiedIndex(preprocessor=preprocessor)
+            small_talk = LazyHandler("small_talk_handler", lambda: intent_classifier, timer)
+            qa = LazyHandler("qa_handler", lambda: intent_classifier, timer)
+        else:
+            intent_classifier = IntentClassifier(preprocessor=preprocessor)
+            small_talk = LazyHandler("small_talk_handler", lambda: build_small_talk_handler(preprocessor), timer)
+            qa = LazyHandler("qa_handler", lambda: build_qa_handler(preprocessor), timer)
+        if timer:
+            timer.mark("intent_classifier", started)
+        return ModelSet(intent_classifier, small_talk, qa, preprocessor, generation)
+
+    @property
+    def preprocessor(self):
+        return self.models.preprocessor
+
+    @property
+    def intent_classifier(self):
+        return self.models.intent_classifier
+
+    def lazy_handlers(self):
+        return [self.models.small_talk, self.models.qa, self._email_handler]
+
+    def start_warm_up(self):
+        def warm_up():
+            for handler in self.lazy_handlers():
+                handler.warm_up()
+            self.timer.mark("warm_up_complete")
+        threading.Thread(target=warm_up, name="handler-warm-up", daemon=True).start()
+
+    @property
+    def small_talk_handler(self):
+        return self.models.small_talk_handler
+
+    @property
+    def qa_handler(self):
+        return self.models.qa_handler
+
+    @property
+    def email_handler(self):
+        return self._email_handler.get()
+
+    # rebuilds all three models from the csvs on a background thread; returns False if a reload is already running.
+    # The handlers swallow their own load errors and come back with no vectorizer, which counts as a failed build
+    def reload_models(self):
+        with self._reload_lock:
+            if self.reloading:
+                return False
+            self.reloading = True
+        threading.Thread(target=self._reload, name="model-reload", daemon=True).start()
+        return True
+
+    def _reload(self):
+        started = time.perf_counter()
+        current = self.models
+        try:
+            models = self._build_models(current.preprocessor.for_rebuild(), generation=current.generation + 1)
+            for name, model in (("intent", models.intent_classifier), ("small talk", models.small_talk_handler), ("QA", models.qa_handler)):
+                if model.vectorizer is None:
+                    raise RuntimeError(f"the {name} model could not be built")
+            self.models = models # a single reference swap, the next prepare() picks it up
+            error = None
+        except Exception as e:
+            error = str(e)
+        took_ms = (time.perf_counter() - started) * 1000
+        metrics.observe("models.reload", took_ms)
+        self.last_reload = {'ok': error is None, 'took_ms': round(took_ms, 1), 'generation': self.models.generation, 'error': error}
+        if error is None:
+            print(f"[RELOAD] Models rebuilt in {took_ms:.0f} ms (generation {self.models.generation})")
+        else:
+            print(f"[SYSTEM ERROR]: Model reload failed after {took_ms:.0f} ms, keeping the current models: {error}")
+        with self._reload_lock:
+            self.reloading = False
+        if self.on_reload is not None:
+            self.on_reload(self.last_reload)
+
+    def model_stats(self):
+        return {'generation': self.models.generation, 'reloading': self.reloading, 'last_reload': self.last_reload}
+
+    def new_session(self, session_key=None):
+        return ChatSession(session_key)
+
+    # generally, we want to the pop the entire group if the chain is completed
+    def manage_state(self, session, new_state):
+        chat_stack = session.chat_stack
+        current_state = chat_stack[-1]
+        if new_state == "normal":
+            if current_state in IDENTITY_TASK_STATES:
+                while chat_stack and chat_stack[-1] in IDENTITY_TASK_STATES:
+                    chat_stack.pop()
+            elif current_state in DISCOVER_TASK_STATES:
+                while chat_stack and chat_stack[-1] in DISCOVER_TASK_STATES:
+                    chat_stack.pop()
+            elif current_state in EMAIL_TASK_STATES:
+                while chat_stack and chat_stack[-1] in EMAIL_TASK_STATES:
+                    chat_stack.pop()
+            elif len(chat_stack) > 1:
+                chat_stack.pop()
+        elif new_state != current_state:
+            chat_stack.append(new_state)
+
+    def _handle_command(self, session, query):
+        chat_stack = session.chat_stack
+        current_state = chat_stack[-1]
+        response = None
+        if query.lower() == "cancel":
+            if current_state in IDENTITY_TASK_STATES:
+                while chat_stack and chat_stack[-1] in IDENTITY_TASK_STATES:
+                    chat_stack.pop()
+                response = f"I've cancelled the identity task. We are now in the '{chat_stack[-1]}' state."
+            elif current_state in DISCOVER_TASK_STATES:
+                while chat_stack and chat_stack[-1] in DISCOVER_TASK_STATES:
+                    chat_stack.pop()
+                response = f"I've cancelled the help task. We are now in the '{chat_stack[-1]}' state."
+            elif current_state in EMAIL_TASK_STATES:
+                while chat_stack and chat_stack[-1] in EMAIL_TASK_STATES:
+                    chat_stack.pop()
+                response = ""
+            elif len(chat_stack) > 1:
+                chat_stack.pop()
+                response = f"I've cancelled the ongoing action. We are now in the '{chat_stack[-1]}' state. What now?"
+            else:
+                response = "There is no ongoing action to cancel."
+        elif query.lower() == "go back":
+            if len(chat_stack) > 1:
+                chat_stack.pop()
+                response = f"Okay, I've gone back one step. We are now in the '{chat_stack[-1]}' state."
+            else:
+                response = "There's nothing to go back to."
+        elif query.lower() == "where am i" or query.lower() == "where am i?":
+            response = f"The chatbot is currently in the '{current_state}' state."
+        elif self.operator_commands and query.lower() == "stats":
+            response = metrics.format_report()
+        elif self.operator_commands and query.lower() == "reload":
+            if self.reload_models():
+                response = "Reloading the intent, small talk and QA datasets in the background. I'll keep using the current models until the new ones are ready."
+            else:
+                response = "A reload is already in progress."
+        # TODO add command 'what now' to explain what the user can do now (especially for the email actions)
+        # TODO add command 'repeat' to repeat the bot response to the initiation of the ongoing action (useful in 'go back' cases)
+        return response
+
+    # universal commands and classification, no network involved
+    def prepare(self, session, query):
+        turn = Turn(query, session.current_state, self.models)
+        turn.response = self._handle_command(session, query)
+        if turn.response is not None:
+            return turn
+        with metrics.span("turn.preprocess"):
+            turn.processed_query = turn.models.preprocessor.process(query) # tokenize/tag/lemmatize once, shared by the classifier and handlers
+        with metrics.span("turn.classify"):
+            turn.intent, turn.subintent, turn.score = turn.models.intent_classifier.classify(turn.processed_query, threshold=0.2)
+        return turn
+
+    # true when respond() will go through the email handler (and so the mail API)
+    def needs_io(self, turn):
+        if turn.response is not None:
+            return False
+        current_state = turn.current_state
+        if current_state in IDENTITY_TASK_STATES or turn.intent == "IdentityManagement" or current_state in DISCOVER_TASK_STATES:
+            return False
+        if turn.intent in ("SmallTalk", "QuestionAnswering"):
+            return False
+        return turn.intent == "Email" or current_state in EMAIL_TASK_STATES
+
+    def respond(self, session, turn):
+        if turn.response is not None:
+            return turn.response, turn.action_data
+        query = turn.query
+        current_state = turn.current_state
+        intent, subintent = turn.intent, turn.subintent
+        processed_query = turn.processed_query
+        response = ""
+        action_data = None
+
+        # Play with the order here to allow certain things mid-action
+        if current_state in IDENTITY_TASK_STATES: # Always want this handled first, I don't want users initiating anything else during this
+            with metrics.span("turn.identity"):
+                response_text, new_name, new_state = self.identity_handler.get_identity_response(query, session.username, subintent="none", current_state=current_state)
+            session.username = new_name
+            self.manage_state(session, new_state)
+            response = response_text
+        elif intent == "IdentityManagement":
+            with metrics.span("turn.identity"):
+                response_text, new_name, new_state = self.identity_handler.get_identity_response(query, session.username, subintent=subintent, current_state=current_state)
+            session.username = new_name
+            self.manage_state(session, new_state)
+            response = response_text
+        elif current_state in DISCOVER_TASK_STATES: # I think this makes sense to put here, but keep discovery initialization low
+            with metrics.span("turn.discoverability"):
+                response_text, new_state = self.discoverability_handler.get_discoverability_response(query, subintent="none", current_state=current_state)
+            self.manage_state(session, new_state)
+            response = response_text
+        elif intent == "SmallTalk":
+            with metrics.span("turn.small_talk"):
+                raw_response = turn.models.small_talk_handler.get_small_talk_response(processed_query, threshold=0.4)
+            if "{username}" in raw_response:
+                name_to_insert = session.username if session.username else "friend"
+                response = raw_response.replace("{username}", name_to_insert)
+            else:
+                response = raw_response
+        elif intent == "QuestionAnswering":
+            with metrics.span("turn.qa"):
+                response = turn.models.qa_handler.get_QA_response(processed_query, threshold=0.65)
+        elif intent == "Email" or current_state in EMAIL_TASK_STATES:
+            with metrics.span("turn.email"):
+                new_state, response_text, session_data, action_data = self.email_handler.handle_email_task(current_state, subintent, query, session.session_id)
+            if session_data is not None:
+                session.session_id, session.email_address = session_data
+            self.manage_state(session, new_state if new_state else "normal")
+            response = response_text
+        elif intent == "Discoverability":
+            with metrics.span("turn.discoverability"):
+                response_text, new_state = self.discoverability_handler.get_discoverability_response(query, subintent=subintent, current_state=current_state)
+            self.manage_state(session, new_state)
+            response = response_text
+        else:
+            if intent == "Unrecognized":
+                response = "Forgive me, but I'm unable to recognize what you are saying."
+            else:
+                response = "[SYSTEM ERROR]: An internal classification error occurred."
+        return response, action_data
+
+    def handle(self, session, query):
+        with metrics.span("turn.total"):
+            return self.respond(session, self.prepare(session, query))
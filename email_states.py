@@ -0,0 +1,12 @@
+EMAIL_AWAITING_STATES = [
+    'awaiting_session_start_confirm',
+    'awaiting_session_restore_confirm',
+    'awaiting_session_restore',
+    'awaiting_session_end_confirm',
+    'awaiting_view_index',
+    'awaiting_delete_index',
+    'awaiting_download_index',
+    'awaiting_delete_all_confirm'
+]
+EMAIL_LOOP_STATES = ['email_manage_loop']
+EMAIL_TASK_STATES = EMAIL_AWAITING_STATES + EMAIL_LOOP_STATES
@@ -1,22 +1,73 @@
 import requests
 import time
+import random
 import os
-import json
+import hashlib
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from requests.exceptions import RequestException, HTTPError, ConnectionError
 from urllib3.exceptions import NameResolutionError
+from inbox_store import InboxStore
+from body_cache import get_shared_body_cache
+from archive_export import ARCHIVE_FORMATS, MboxArchive, ZipArchive
+from metrics import metrics
+from circuit_breaker import CircuitBreakerRegistry, CircuitOpenError
+from single_flight import SingleFlight
+
+INBOX_PAGE_SIZE = 20 # guerrilla returns at most this many messages per list/check call
+REQUEST_TIMEOUT = 10
+DOWNLOAD_CONCURRENCY = 8 # stays under requests' default pool of 10 keep-alive connections
+DOWNLOAD_REQUEST_TIMEOUT = 15
+IDEMPOTENT_CALLS = {'get_email_list', 'fetch_email', 'check_email'} # safe to resend, everything else runs once
+RETRY_ATTEMPTS = 3
+RETRY_DEADLINE = 12 # seconds across all attempts of one call
+RETRY_BACKOFF_BASE = 0.25
+RETRY_BACKOFF_CAP = 2.0
+MIN_ATTEMPT_TIMEOUT = 0.5
+
+mail_api_breakers = CircuitBreakerRegistry()
+mail_api_flights = SingleFlight()
+metrics.register_gauge("circuit_breakers", mail_api_breakers.stats)
+metrics.register_gauge("single_flight", mail_api_flights.stats)
+
+class MalformedResponse(Exception):
+    pass
+
+# timeouts, dropped connections, 5xx, 429 and garbled bodies count against the breaker; other 4xx mean the service is up
+def _is_service_failure(error):
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, HTTPError) and error.response is not None:
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return True
 
 class GuerrillaSession:
     
     API_URL = "https://api.guerrillamail.com/ajax.php"
 
-    def __init__(self, lang='en'):
+    def __init__(self, lang='en', delta_sync=True, body_cache=None, api_url=None, breakers=None):
         self.session = requests.Session()
+        self.breakers = breakers if breakers is not None else mail_api_breakers
+        self.flights = mail_api_flights
+        self.api_url = api_url or self.API_URL # point at guerrilla_standin.py for offline runs
         self.lang = lang
         self.sid_token = None
         self.email_addr = None
         self.email_timestamp = None
         self.alias = None
-        self.inbox = []
+        self.inbox = InboxStore()
+        self.delta_sync = delta_sync
+        self.last_seq = None # highest mail_id merged so far, check_email only sends what came after it
+        self.known_count = None # server's message count as of the last sync, used to spot gaps
+        self._body_cache = body_cache
+
+    @property
+    def body_cache(self):
+        if self._body_cache is None:
+            self._body_cache = get_shared_body_cache() # opened on first use so sessions that never read mail don't touch disk
+        return self._body_cache
         
     def start_new_session(self):
         params = {'lang': self.lang}
@@ -50,13 +101,69 @@ class GuerrillaSession:
         self.email_timestamp = response_json.get('email_timestamp', self.email_timestamp)
         self.alias = response_json.get('alias', self.alias)
         
-        if 'list' in response_json:
-            existing_ids = {email['mail_id'] for email in self.inbox}
-            new_emails = [email for email in response_json['list'] if email['mail_id'] not in existing_ids]
-            self.inbox = new_emails + self.inbox
-            self.inbox.sort(key=lambda x: int(x.get('mail_timestamp', 0)), reverse=True)
+        if 'list' in response_json and response_json['list']:
+            self.inbox.merge(response_json['list'])
+            highest = max(int(email['mail_id']) for email in response_json['list'])
+            if self.last_seq is None or highest > self.last_seq:
+                self.last_seq = highest
+
+    def _response_count(self, response):
+        try:
+            return int(response.get('count'))
+        except (TypeError, ValueError):
+            return None
 
-    def _api_call(self, func_name, params=None, method='GET'):
+    def _send(self, func_name, params_list, method, timeout):
+        with metrics.span(f"mail_api.{func_name}"): # failures land in the mail_api.<f>.errors counter
+            if method.upper() == 'GET':
+                response = self.session.get(self.api_url, params=params_list, timeout=timeout)
+            elif method.upper() == 'POST':
+                response = self.session.post(self.api_url, data=params_list, timeout=timeout)
+            else:
+                raise ValueError("Method must be 'GET' or 'POST'")
+
+            response.raise_for_status()
+            try:
+                return response.json()
+            except ValueError:
+                print(f"[GuerrillaSession ERROR] Failed to decode JSON response: {response.text}")
+                raise MalformedResponse("Failed to decode API response.")
+
+    # idempotent reads are retried with jittered backoff inside one overall deadline; every call goes
+    # through its endpoint's circuit breaker, so a dead endpoint fails fast instead of costing a full timeout
+    def _request(self, func_name, params_list, method, timeout):
+        breaker = self.breakers.get(func_name)
+        retryable = method.upper() == 'GET' and func_name in IDEMPOTENT_CALLS
+        attempts = RETRY_ATTEMPTS if retryable else 1
+        deadline = time.monotonic() + (max(RETRY_DEADLINE, timeout) if retryable else timeout)
+        attempt = 0
+        while True:
+            attempt += 1
+            breaker.before_call()
+            try:
+                response_json = self._send(func_name, params_list, method, min(timeout, max(MIN_ATTEMPT_TIMEOUT, deadline - time.monotonic())))
+            except (ConnectionError, NameResolutionError, HTTPError, RequestException, MalformedResponse) as e:
+                if not _is_service_failure(e):
+                    breaker.record_success() # the service answered, the request itself was refused
+                    print(f"[GuerrillaSession ERROR] API call failed: {e}")
+                    raise e
+                breaker.record_failure()
+                delay = random.uniform(0, min(RETRY_BACKOFF_CAP, RETRY_BACKOFF_BASE * (2 ** (attempt - 1))))
+                if attempt < attempts and time.monotonic() + delay + MIN_ATTEMPT_TIMEOUT < deadline:
+                    metrics.incr(f"mail_api.{func_name}.retries")
+                    time.sleep(delay)
+                    continue
+                print(f"[GuerrillaSession ERROR] API call failed: {e}")
+                if isinstance(e, MalformedResponse):
+                    raise Exception(str(e))
+                raise e
+            except Exception:
+                breaker.record_failure() # never leave a half-open probe slot taken
+                raise
+            breaker.record_success()
+            return response_json
+
+    def _api_call(self, func_name, params=None, method='GET', timeout=REQUEST_TIMEOUT):
         if params is None:
             params = {}
         if isinstance(params, dict):
@@ -68,40 +175,58 @@ class GuerrillaSession:
         if self.sid_token and 'sid_token' not in [p[0] for p in params_list]:
             params_list.append(('sid_token', self.sid_token))
 
-        try:
-            if method.upper() == 'GET':
-                response = self.session.get(self.API_URL, params=params_list, timeout=10)
-            elif method.upper() == 'POST':
-                response = self.session.post(self.API_URL, data=params_list, timeout=10)
-            else:
-                raise ValueError("Method must be 'GET' or 'POST'")
+        if method.upper() == 'GET' and func_name in IDEMPOTENT_CALLS:
+            # identical reads already in flight (same url, sid and arguments) share one round trip; writes never do
+            key = (self.api_url, func_name, tuple(sorted((name, str(value)) for name, value in params_list)))
+            response_json, shared = self.flights.do(key, lambda: self._request(func_name, params_list, method, timeout))
+            if shared:
+                metrics.incr(f"mail_api.{func_name}.coalesced")
+        else:
+            response_json = self._request(func_name, params_list, method, timeout)
 
-            response.raise_for_status()
-            response_json = response.json()
-            
-            if 'sid_token' in response_json and response_json['sid_token'] != self.sid_token:
-                self.sid_token = response_json['sid_token']
-            
-            self._update_session_details(response_json)
-            return response_json
+        if isinstance(response_json, dict) and 'sid_token' in response_json and response_json['sid_token'] != self.sid_token: # forget_me and a missing fetch_email answer with a bare true/false
+            self.sid_token = response_json['sid_token']
 
-        except (ConnectionError, NameResolutionError, HTTPError, RequestException) as e:
-            print(f"[GuerrillaSession ERROR] API call failed: {e}")
-            raise e
-        except json.JSONDecodeError:
-            print(f"[GuerrillaSession ERROR] Failed to decode JSON response: {response.text}")
-            raise Exception("Failed to decode API response.")
-            
-        return None 
+        self._update_session_details(response_json)
+        return response_json
 
     def get_inbox_list(self, offset=0):
         if not self.sid_token:
             raise Exception("No active session.")
+        if self.delta_sync and offset == 0 and self.last_seq is not None:
+            return self.sync_inbox()
         response = self._api_call('get_email_list', {'offset': str(offset)})
         if response and 'list' in response:
+            if offset == 0:
+                self.known_count = self._response_count(response)
             return self.inbox # Return the raw data
         return [] # Return empty list on failure
 
+    # only transfers messages newer than last_seq; falls back to a full list when the server reports more
+    # than we can account for (a full page of new mail, or a count that skipped ahead)
+    def sync_inbox(self):
+        if not self.sid_token:
+            raise Exception("No active session.")
+        response = self._api_call('check_email', {'seq': str(self.last_seq)})
+        if not response or 'list' not in response:
+            return self._full_resync()
+        received = len(response['list'])
+        count = self._response_count(response)
+        if received >= INBOX_PAGE_SIZE:
+            return self._full_resync()
+        if count is not None and self.known_count is not None and count > self.known_count + received:
+            return self._full_resync()
+        if count is not None:
+            self.known_count = count
+        return self.inbox
+
+    def _full_resync(self):
+        response = self._api_call('get_email_list', {'offset': '0'})
+        if response and 'list' in response:
+            self.known_count = self._response_count(response)
+            return self.inbox
+        return []
+
     def _get_email_ids_from_indices(self, indices_str):
         if not self.inbox:
             return []
@@ -110,7 +235,7 @@ class GuerrillaSession:
         max_index = len(self.inbox)
         
         if indices_str.lower() == 'all':
-            return [email['mail_id'] for email in self.inbox]
+            return self.inbox.ids()
             
         parts = indices_str.split(',')
         for part in parts:
@@ -131,7 +256,7 @@ class GuerrillaSession:
                 except ValueError:
                     continue
                     
-        mail_ids = [self.inbox[i]['mail_id'] for i in sorted(list(indices_to_process))]
+        mail_ids = [self.inbox[i].mail_id for i in sorted(list(indices_to_process))]
         return mail_ids
 
     def fetch_email_body(self, index):
@@ -144,11 +269,16 @@ class GuerrillaSession:
         except ValueError:
             raise ValueError("Index must be a number.")
             
-        mail_id = self.inbox[index_int - 1]['mail_id']
-        response = self._api_call('fetch_email', {'email_id': mail_id})
+        record = self.inbox.at(index_int)
+        response = self._cached_body(record.mail_id)
+        if response is None:
+            response = self._api_call('fetch_email', {'email_id': record.mail_id})
+            if response and 'mail_body' in response:
+                self._cache_body(record.mail_id, response)
         
         if response and 'mail_body' in response:
-            self.inbox[index_int - 1]['mail_read'] = '1'
+            record.mail_read = '1'
+            self.inbox.bodies[record.mail_id] = response['mail_body']
             return response
         return None
 
@@ -165,11 +295,53 @@ class GuerrillaSession:
         
         if response and 'deleted_ids' in response:
             deleted_ids_set = set(response['deleted_ids'])
-            self.inbox = [email for email in self.inbox if email['mail_id'] not in deleted_ids_set]
+            self.inbox.remove(deleted_ids_set)
+            self.body_cache.invalidate(self.sid_token, deleted_ids_set)
+            if self.known_count is not None:
+                self.known_count = max(0, self.known_count - len(deleted_ids_set))
             return deleted_ids_set
         return None
 
-    def download_emails(self, indices_str):
+    # a sync running alongside a download may already have dropped the message
+    def _mark_read(self, mail_id):
+        record = self.inbox.get(mail_id)
+        if record is not None:
+            record.mail_read = '1'
+
+    def _email_filename(self, mail_id, email_data):
+        subject = email_data.get('mail_subject', 'no_subject').replace(' ', '_')
+        subject = "".join(c for c in subject if c.isalnum() or c in ('_', '-')).rstrip()
+        return f"{mail_id}_{subject[:30]}.html"
+
+    # the cache only saves a round trip, so a locked or corrupt one counts as a miss instead of failing the fetch
+    def _cached_body(self, mail_id):
+        try:
+            return self.body_cache.get(self.sid_token, mail_id)
+        except sqlite3.Error as e:
+            print(f"[GuerrillaSession ERROR] Body cache read failed for {mail_id}: {e}")
+            return None
+
+    def _cache_body(self, mail_id, email_data):
+        try:
+            self.body_cache.put(self.sid_token, mail_id, email_data)
+        except sqlite3.Error as e:
+            print(f"[GuerrillaSession ERROR] Body cache write failed for {mail_id}: {e}")
+
+    def _fetch_for_download(self, mail_id, timeout):
+        cached = self._cached_body(mail_id)
+        if cached is not None:
+            return cached
+        try:
+            email_data = self._api_call('fetch_email', {'email_id': mail_id}, timeout=timeout)
+        except Exception as e:
+            print(f"[GuerrillaSession ERROR] Could not fetch email {mail_id}: {e}")
+            return None
+        if isinstance(email_data, dict) and 'mail_body' in email_data:
+            self._cache_body(mail_id, email_data)
+        return email_data
+
+    # bodies are fetched by a bounded pool while a single writer thread puts finished ones on disk
+    def download_emails(self, indices_str, concurrency=DOWNLOAD_CONCURRENCY, request_timeout=DOWNLOAD_REQUEST_TIMEOUT):
         if not self.sid_token:
             raise Exception("No active session.")
         
@@ -180,33 +352,109 @@ class GuerrillaSession:
         save_dir = os.path.join("downloads", self.sid_token)
         os.makedirs(save_dir, exist_ok=True)
         
-        downloaded_files = []
+        written = {}
+        write_errors = []
         failed_files = 0
-        
-        for mail_id in mail_ids:
-            index = next((i for i, email in enumerate(self.inbox) if email['mail_id'] == mail_id), -1)
-            if index == -1:
-                failed_files += 1
-                continue
+        write_queue = queue.Queue(maxsize=concurrency * 2)
 
-            email_data = self.fetch_email_body(index + 1)
-            
-            if isinstance(email_data, dict) and 'mail_body' in email_data:
-                subject = email_data.get('mail_subject', 'no_subject').replace(' ', '_')
-                subject = "".join(c for c in subject if c.isalnum() or c in ('_', '-')).rstrip()
-                filename = f"{mail_id}_{subject[:30]}.html"
-                filepath = os.path.join(save_dir, filename)   
+        def writer():
+            while True:
+                item = write_queue.get()
+                if item is None:
+                    return
+                mail_id, filepath, body = item
                 try:
                     with open(filepath, 'w', encoding='utf-8') as f:
-                        f.write(email_data['mail_body'])
-                    downloaded_files.append(filepath)
+                        f.write(body)
+                    written[mail_id] = filepath
                 except IOError as e:
                     print(f"Error writing file {filepath}: {e}")
-                    failed_files += 1
-            else:
-                failed_files += 1
+                    write_errors.append(mail_id)
+
+        writer_thread = threading.Thread(target=writer, name="email-writer", daemon=True)
+        writer_thread.start()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="email-fetch") as pool:
+                futures = {}
+                for mail_id in mail_ids:
+                    if mail_id not in self.inbox:
+                        failed_files += 1
+                        continue
+                    futures[pool.submit(self._fetch_for_download, mail_id, request_timeout)] = mail_id
+                for future in as_completed(futures):
+                    mail_id = futures[future]
+                    email_data = future.result()
+                    if isinstance(email_data, dict) and 'mail_body' in email_data:
+                        self._mark_read(mail_id)
+                        filepath = os.path.join(save_dir, self._email_filename(mail_id, email_data))
+                        write_queue.put((mail_id, filepath, email_data['mail_body']))
+                    else:
+                        failed_files += 1
+        finally:
+            write_queue.put(None)
+            writer_thread.join()
+
+        downloaded_files = [written[mail_id] for mail_id in mail_ids if mail_id in written]
+        failed_files += len(write_errors)
         return (downloaded_files, failed_files)
 
+    # streams the selected messages into one archive as they arrive; at most concurrency * 2 bodies are held at a
+    # time, and rerunning after an interruption picks up after the last message that made it into the archive
+    def export_archive(self, indices_str='all', archive_format='mbox', concurrency=DOWNLOAD_CONCURRENCY, request_timeout=DOWNLOAD_REQUEST_TIMEOUT):
+        if not self.sid_token:
+            raise Exception("No active session.")
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError(f"Archive format must be one of: {', '.join(ARCHIVE_FORMATS)}.")
+
+        mail_ids = self._get_email_ids_from_indices(indices_str)
+        if not mail_ids:
+            raise ValueError("No valid email indices provided.")
+
+        save_dir = os.path.join("downloads", self.sid_token)
+        os.makedirs(save_dir, exist_ok=True)
+        # one archive per selection, so a different one never overwrites or extends it, and rerunning the same one resumes it
+        selection = hashlib.sha1(','.join(sorted(map(str, mail_ids))).encode('utf-8')).hexdigest()[:12]
+        archive_path = os.path.join(save_dir, f"inbox-{selection}.{archive_format}")
+        if archive_format == 'zip':
+            archive = ZipArchive(archive_path, self._email_filename, selection)
+        else:
+            archive = MboxArchive(archive_path, selection)
+
+        done = archive.open()
+        skipped = sum(1 for mail_id in mail_ids if mail_id in done)
+        pending = iter([mail_id for mail_id in mail_ids if mail_id not in done and mail_id in self.inbox])
+        exported = 0
+        failed_files = sum(1 for mail_id in mail_ids if mail_id not in done and mail_id not in self.inbox)
+        complete = False
+        window = max(1, concurrency) * 2
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="email-export") as pool:
+                in_flight = {}
+                for mail_id in pending:
+                    in_flight[pool.submit(self._fetch_for_download, mail_id, request_timeout)] = mail_id
+                    if len(in_flight) >= window:
+                        break
+                while in_flight:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        mail_id = in_flight.pop(future)
+                        email_data = future.result()
+                        if isinstance(email_data, dict) and 'mail_body' in email_data:
+                            archive.write(mail_id, email_data)
+                            self._mark_read(mail_id)
+                            exported += 1
+                        else:
+                            failed_files += 1
+                    for mail_id in pending:
+                        in_flight[pool.submit(self._fetch_for_download, mail_id, request_timeout)] = mail_id
+                        if len(in_flight) >= window:
+                            break
+            complete = failed_files == 0
+        finally:
+            archive.close(complete=complete)
+
+        return (archive_path, exported, skipped, failed_files)
+
     def forget_current_email(self):
         if not self.sid_token:
             raise Exception("No active session.")
@@ -214,12 +462,16 @@ class GuerrillaSession:
             return True 
          
         params = {'email_addr': self.email_addr}
+        sid_token = self.sid_token
         response = self._api_call('forget_me', params, method='POST')
         
         if response:
+            self.body_cache.invalidate(sid_token)
             self.email_addr = None
             self.email_timestamp = None
             self.alias = None
-            self.inbox = []
+            self.inbox.clear()
+            self.last_seq = None
+            self.known_count = None
             return True
         return False
\ No newline at end of file
@@ -0,0 +1,232 @@
+import json
+import time
+import random
+import string
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PAGE_SIZE = 20
+FIRST_MAIL_ID = 1000
+SUBJECTS = ["Your weekly digest", "Verify your account", "Invoice attached", "Meeting notes", "Welcome aboard", "Password reset request", "Order shipped", "Newsletter"]
+
+class StandInMailbox:
+    def __init__(self, sid_token, email_addr):
+        self.sid_token = sid_token
+        self.email_addr = email_addr
+        self.email_timestamp = int(time.time())
+        self.mails = {} # mail_id -> full message, bodies included
+        self.last_timestamp = 0
+
+    def listing(self, mail):
+        return {key: value for key, value in mail.items() if key != 'mail_body'}
+
+    def newest_first(self):
+        return sorted(self.mails.values(), key=lambda mail: (-mail['mail_timestamp'], -int(mail['mail_id'])))
+
+class GuerrillaStandIn:
+    # speaks the subset of ajax.php that GuerrillaSession uses, with the same json shapes, so the email flow can run
+    # offline; latency, error_rate and inbox_size shape the load, deliver() drops new mail into a live inbox
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, error_functions=None, inbox_size=0, body_size=2048, seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.error_functions = set(error_functions) if error_functions else None
+        self.inbox_size = inbox_size
+        self.body_size = body_size
+        self.random = random.Random(seed)
+        self.mailboxes = {}
+        self.next_mail_id = FIRST_MAIL_ID
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/ajax.php"
+
+    def _new_sid(self):
+        return "".join(self.random.choice(string.ascii_lowercase + string.digits) for _ in range(24))
+
+    def _make_mail(self, sequence, timestamp):
+        mail_id = str(self.next_mail_id)
+        self.next_mail_id += 1
+        subject = f"{SUBJECTS[sequence % len(SUBJECTS)]} #{sequence}"
+        sender = f"sender{sequence % 50}@example.com"
+        paragraph = f"<p>Message {mail_id} for testing. " + "Lorem ipsum dolor sit amet. " * 8 + "</p>"
+        body = (paragraph * (self.body_size // len(paragraph) + 1))[:self.body_size]
+        return {
+            'mail_id': mail_id,
+            'mail_from': sender,
+            'mail_subject': subject,
+            'mail_excerpt': f"Message {mail_id} for testing.",
+            'mail_timestamp': timestamp,
+            'mail_date': time.strftime("%H:%M:%S", time.gmtime(timestamp)),
+            'mail_read': 0,
+            'mail_size': str(len(body)),
+            'att': '0',
+            'mail_body': body,
+        }
+
+    def create_mailbox(self, inbox_size=None):
+        with self._lock:
+            sid_token = self._new_sid()
+            mailbox = StandInMailbox(sid_token, f"{sid_token[:10]}@guerrillamailblock.com")
+            self.mailboxes[sid_token] = mailbox
+        self.deliver(sid_token, self.inbox_size if inbox_size is None else inbox_size)
+        return mailbox
+
+    def deliver(self, sid_token, count=1):
+        with self._lock:
+            mailbox = self.mailboxes[sid_token]
+            start = max(int(time.time()) - count, mailbox.last_timestamp + 1) # later deliveries always sort as newer
+            for sequence in range(count):
+                mail = self._make_mail(len(mailbox.mails) + 1, start + sequence)
+                mailbox.mails[mail['mail_id']] = mail
+                mailbox.last_timestamp = mail['mail_timestamp']
+        return count
+
+    def _session_fields(self, mailbox):
+        return {'email_addr': mailbox.email_addr, 'email_timestamp': mailbox.email_timestamp, 'alias': mailbox.email_addr.split('@')[0], 'sid_token': mailbox.sid_token}
+
+    def _list_response(self, mailbox, mails):
+        return {'list': [mailbox.listing(mail) for mail in mails], 'count': str(len(mailbox.mails)), 'email': mailbox.email_addr, 'ts': int(time.time()), 'sid_token': mailbox.sid_token}
+
+    def handle_call(self, params):
+        func = params.get('f', '')
+        with self._lock:
+            self.calls[func] = self.calls.get(func, 0) + 1
+        sid_token = params.get('sid_token')
+        with self._lock:
+            mailbox = self.mailboxes.get(sid_token) if sid_token else None
+
+        if func == 'get_email_address':
+            if sid_token and mailbox is None:
+                return 200, {'auth': {'success': False, 'error_codes': ['auth-session-not-initialized']}}
+            if mailbox is None:
+                mailbox = self.create_mailbox()
+            return 200, self._session_fields(mailbox)
+        if mailbox is None:
+            return 200, {'auth': {'success': False, 'error_codes': ['auth-session-not-initialized']}}
+
+        with self._lock:
+            if func == 'get_email_list':
+                offset = int(params.get('offset', 0) or 0)
+                return 200, self._list_response(mailbox, mailbox.newest_first()[offset:offset + PAGE_SIZE])
+            if func == 'check_email':
+                seq = int(params.get('seq', 0) or 0)
+                newer = [mail for mail in mailbox.newest_first() if int(mail['mail_id']) > seq]
+                return 200, self._list_response(mailbox, newer[:PAGE_SIZE])
+            if func == 'fetch_email':
+                mail = mailbox.mails.get(str(params.get('email_id')))
+                if mail is None:
+                    return 200, False
+                mail['mail_read'] = 1
+                return 200, dict(mail, sid_token=mailbox.sid_token)
+            if func == 'del_email':
+                deleted = [mail_id for mail_id in params.get('email_ids[]', []) if mailbox.mails.pop(str(mail_id), None) is not None]
+                return 200, {'deleted_ids': deleted, 'sid_token': mailbox.sid_token}
+            if func == 'forget_me':
+                if params.get('email_addr') != mailbox.email_addr:
+                    return 200, False
+                mailbox.mails.clear()
+                mailbox.email_addr = f"{self._new_sid()[:10]}@guerrillamailblock.com"
+                return 200, True
+        return 400, {'error': f"Unknown function {func}."}
+
+    def _inject(self, func):
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+        if self.error_rate and (self.error_functions is None or func in self.error_functions):
+            with self._lock:
+                failed = self.random.random() < self.error_rate
+            if failed:
+                return self.error_status
+        return None
+
+    def _handler_class(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _params(self, body=b''):
+                pairs = parse_qsl(urlparse(self.path).query) + parse_qsl(body.decode('utf-8'))
+                params = {}
+                for key, value in pairs:
+                    if key.endswith('[]'):
+                        params.setdefault(key, []).append(value)
+                    else:
+                        params[key] = value
+                return params
+
+            def _reply(self, params):
+                status = standin._inject(params.get('f', ''))
+                payload = {'error': "Injected failure."} if status else None
+                if status is None:
+                    status, payload = standin.handle_call(params)
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._reply(self._params())
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                self._reply(self._params(self.rfile.read(length) if length else b''))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler_class())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="guerrilla-standin", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local Guerrilla Mail stand-in for offline runs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds, uniformly random")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--error-functions", nargs="*", help="only inject errors into these api functions")
+    parser.add_argument("--inbox-size", type=int, default=0, help="messages waiting in every new inbox")
+    parser.add_argument("--body-size", type=int, default=2048, help="bytes per synthetic message body")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    standin = GuerrillaStandIn(args.host, args.port, args.latency, args.jitter, args.error_rate, args.error_status, args.error_functions, args.inbox_size, args.body_size, args.seed).start()
+    print(f"[STANDIN] Serving the Guerrilla Mail api at {standin.url} (run main.py with --mail-api-url {standin.url})")
+    try:
+        standin._thread.join()
+    except KeyboardInterrupt:
+        standin.stop()
@@ -0,0 +1,113 @@
+import heapq
+from bisect import insort
+
+INSORT_MAX = 32 # up to this many adds are placed one by one, more are sorted and merged in one pass
+
+class EmailRecord:
+    __slots__ = ('mail_id', 'mail_from', 'mail_subject', 'mail_excerpt', 'mail_timestamp', 'mail_date', 'mail_read', 'mail_size', 'att')
+
+    def __init__(self, data):
+        self.mail_id = str(data['mail_id'])
+        self.mail_from = data.get('mail_from', '')
+        self.mail_subject = data.get('mail_subject', '')
+        self.mail_excerpt = data.get('mail_excerpt', '')
+        self.mail_timestamp = int(data.get('mail_timestamp', 0) or 0)
+        self.mail_date = data.get('mail_date', '')
+        self.mail_read = str(data.get('mail_read', '0'))
+        self.mail_size = data.get('mail_size', '')
+        self.att = data.get('att', '0')
+
+    @property
+    def sort_key(self):
+        return (-self.mail_timestamp, -int(self.mail_id) if self.mail_id.isdigit() else 0, self.mail_id)
+
+    # dict-style access so callers written against the raw api dicts keep working
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+class InboxStore:
+    # records keyed by mail_id plus a newest-first positional index; bodies live apart from the records.
+    # add() is o(1): new (sort key, id) pairs wait in _added until the next positional read, which sorts and
+    # merges them into _order in one o(n + k log k) pass, so a large sync never pays an o(n) insert per mail.
+    # A poll that brings a few mails (up to INSORT_MAX) has them insorted instead
+    def __init__(self):
+        self._records = {}
+        self._order = [] # (sort key, mail id), newest first, as of the last positional read
+        self._added = [] # (sort key, mail id) added since
+        self.bodies = {}
+
+    def __len__(self):
+        return len(self._records)
+
+    def __bool__(self):
+        return bool(self._records)
+
+    def __iter__(self):
+        return (self._records[mail_id] for key, mail_id in self._ordered())
+
+    def __contains__(self, mail_id):
+        return str(mail_id) in self._records
+
+    def _ordered(self):
+        if len(self._added) > INSORT_MAX:
+            self._order = list(heapq.merge(self._order, sorted(self._added)))
+        else:
+            for entry in self._added: # a memmove each, cheaper than a python-level merge for a few new mails
+                insort(self._order, entry)
+        self._added = []
+        return self._order
+
+    # 0-based like the old list; at() is the 1-based view the chat commands use
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self._records[mail_id] for key, mail_id in self._ordered()[position]]
+        return self._records[self._ordered()[position][1]]
+
+    def at(self, position):
+        if not (1 <= position <= len(self._records)):
+            raise IndexError(f"Index {position} is out of bounds (1-{len(self._records)}).")
+        return self._records[self._ordered()[position - 1][1]]
+
+    def get(self, mail_id):
+        return self._records.get(str(mail_id))
+
+    def ids(self):
+        return [mail_id for key, mail_id in self._ordered()]
+
+    def add(self, data):
+        mail_id = str(data['mail_id'])
+        if mail_id in self._records:
+            return False
+        record = EmailRecord(data)
+        self._records[mail_id] = record
+        self._added.append((record.sort_key, mail_id))
+        return True
+
+    def merge(self, emails):
+        return sum(1 for email in emails if self.add(email))
+
+    def remove(self, mail_ids):
+        mail_ids = {str(mail_id) for mail_id in mail_ids}
+        removed = [mail_id for mail_id in mail_ids if self._records.pop(mail_id, None) is not None]
+        if removed:
+            self._order = [entry for entry in self._order if entry[1] not in mail_ids]
+            self._added = [entry for entry in self._added if entry[1] not in mail_ids]
+            for mail_id in removed:
+                self.bodies.pop(mail_id, None)
+        return removed
+
+    def clear(self):
+        self._records.clear()
+        self._order = []
+        self._added = []
+        self.bodies.clear()
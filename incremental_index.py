@@ -0,0 +1,123 @@
+import time
+import threading
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+from scoring import SparseScorer, select_top_k
+
+HASH_FEATURES = 2 ** 20
+REFRESH_GROWTH = 0.1 # reweight every row once the corpus has grown this much since the last idf refresh
+
+class IncrementalIndex:
+    # tf-idf over hashed term counts, so the feature space never changes and rows can be appended without a refit.
+    # Document frequencies are kept up to date on every append, but existing rows keep the idf they were weighted
+    # with until the corpus has grown by REFRESH_GROWTH (or refresh() is called); terms first seen in an append get
+    # their idf right away. Right after a refresh the scores match TfidfVectorizer's up to hash collisions.
+    # Stands in for both the vectorizer (transform) and the scorer (top_k) of the handler it is attached to.
+    def __init__(self, vectorizer_params, documents, n_features=HASH_FEATURES):
+        params = {key: value for key, value in vectorizer_params.items() if key in ('analyzer', 'stop_words', 'lowercase', 'token_pattern', 'ngram_range')}
+        self.hasher = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None, **params)
+        self.df = np.zeros(n_features, dtype=np.int64)
+        self.num_docs = 0
+        self.refreshed_at = 0
+        self.idf_ = np.zeros(n_features)
+        self._counts = []
+        self._base = None
+        self._base_scorer = None
+        self._delta = []
+        self._delta_scorer = None
+        self._lock = threading.Lock()
+        self.add(documents)
+        self.refresh()
+
+    def _idf(self):
+        idf = np.log((1 + self.num_docs) / (1 + self.df)) + 1
+        idf[self.df == 0] = 0.0 # like a fitted vocabulary, terms no document has never count
+        return idf
+
+    def _weigh(self, counts):
+        weighted = counts.multiply(self.idf_).tocsr()
+        return normalize(weighted) if weighted.shape[0] else weighted # normalize refuses zero rows
+
+    @property
+    def num_rows(self):
+        return self.num_docs
+
+    @property
+    def stale(self):
+        return self.num_docs > self.refreshed_at * (1 + REFRESH_GROWTH)
+
+    # o(new rows): hash, update document frequencies, weight the new rows with the current idf
+    def add(self, documents):
+        if not documents:
+            return 0
+        counts = self.hasher.transform(documents).tocsr()
+        counts.sum_duplicates()
+        with self._lock:
+            np.add.at(self.df, counts.indices, 1)
+            self.num_docs += counts.shape[0]
+            new_terms = np.unique(counts.indices[self.idf_[counts.indices] == 0])
+            if len(new_terms):
+                self.idf_[new_terms] = np.log((1 + self.num_docs) / (1 + self.df[new_terms])) + 1
+            self._counts.append(counts)
+            self._delta.append(self._weigh(counts))
+            self._delta_scorer = None
+        return counts.shape[0]
+
+    # recomputes idf from the maintained document frequencies and reweights every row into one segment
+    def refresh(self):
+        with self._lock:
+            self.idf_ = self._idf()
+            if not self._counts: # no rows yet, e.g. built over an empty dataset
+                counts = csr_matrix((0, self.hasher.n_features))
+            elif len(self._counts) > 1:
+                counts = vstack(self._counts).tocsr()
+            else:
+                counts = self._counts[0]
+            self._counts = [counts]
+            self._base = self._weigh(counts)
+            self._base_scorer = SparseScorer(self._base) if counts.shape[0] else None
+            self._delta = []
+            self._delta_scorer = None
+            self.refreshed_at = self.num_docs
+
+    def transform(self, documents):
+        if self.stale:
+            self.refresh()
+        return normalize(self.hasher.transform(documents).multiply(self.idf_).tocsr())
+
+    def _segments(self):
+        with self._lock:
+            if self._delta and self._delta_scorer is None:
+                self._delta_scorer = SparseScorer(vstack(self._delta).tocsr())
+            return self._base_scorer, self._base.shape[0], self._delta_scorer
+
+    # same contract as SparseScorer.top_k, merged across the refreshed rows and the appends since;
+    # with no rows at all there is nothing to return, so indices and scores come back with zero columns
+    def top_k(self, queries_tfidf, k=1):
+        base_scorer, base_rows, delta_scorer = self._segments()
+        if base_scorer is None:
+            if delta_scorer is not None:
+                return delta_scorer.top_k(queries_tfidf, k)
+            empty = (queries_tfidf.shape[0], 0)
+            return np.zeros(empty, dtype=int), np.zeros(empty), {'product_ms': 0.0, 'select_ms': 0.0}
+        indices, scores, timings = base_scorer.top_k(queries_tfidf, k)
+        if delta_scorer is None:
+            return indices, scores, timings
+        delta_indices, delta_scores, delta_timings = delta_scorer.top_k(queries_tfidf, k)
+        started = time.perf_counter()
+        k = indices.shape[1]
+        merged_indices = np.zeros((indices.shape[0], k), dtype=int)
+        merged_scores = np.zeros((indices.shape[0], k))
+        for row in range(indices.shape[0]):
+            row_indices = np.concatenate([indices[row], delta_indices[row] + base_rows])
+            row_scores = np.concatenate([scores[row], delta_scores[row]])
+            row_indices, row_scores = select_top_k(row_indices, row_scores, k)
+            merged_indices[row] = row_indices
+            merged_scores[row] = row_scores
+        timings = {
+            'product_ms': timings['product_ms'] + delta_timings['product_ms'],
+            'select_ms': timings['select_ms'] + delta_timings['select_ms'] + (time.perf_counter() - started) * 1000
+        }
+        return merged_indices, merged_scores, timings
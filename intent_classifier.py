@@ -1,56 +1,57 @@
-import pandas as pd
-import numpy as np
-import nltk
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from nltk.stem import WordNetLemmatizer
-from nltk.corpus import wordnet
-#from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-
-pos_map = {'ADJ': 'a', 'ADV': 'r', 'NOUN': 'n', 'VERB': 'v'}
-
-class IntentClassifier:
-    def __init__(self, data_path="datasets/intents_data.csv"):
-        self.lemmatizer = WordNetLemmatizer()
-        self.vectorizer = None
-        self.intent_phrases_tfidf = None
+from model_store import MODEL_DIR
+from retrieval import TfidfRetriever
+
+VECTORIZER_PARAMS = {'analyzer': 'word'}
+
+class IntentClassifier(TfidfRetriever):
+    vectorizer_params = VECTORIZER_PARAMS
+    metrics_prefix = "intent"
+    load_error = "Error with loading or training intent data"
+
+    def __init__(self, data_path="datasets/intents_data.csv", preprocessor=None, model_dir=MODEL_DIR):
         self.phrases = []
         self.intents = []
         self.subintents = []
-        self._load_and_train(data_path)
-
-    def _preprocess(self, text):
-        tokens = nltk.word_tokenize(text.lower())
-        tagged = nltk.pos_tag(tokens, tagset='universal')
-        return ' '.join(self.lemmatizer.lemmatize(w, pos=pos_map.get(t, 'n')) for w, t in tagged if w.isalnum())
-
-    def _load_and_train(self, data_path):
-        try:
-            df = pd.read_csv(data_path)
-            df['Subintent'] = df['Subintent'].fillna('none') 
-            self.phrases = [self._preprocess(p) for p in df['Phrase'].tolist()]
-            self.intents = df['Intent'].tolist()
-            self.subintents = df['Subintent'].tolist()
-            self.vectorizer = TfidfVectorizer(analyzer='word')
-            self.intent_phrases_tfidf = self.vectorizer.fit_transform(self.phrases)
-        except Exception as e:
-            print(f"[SYSTEM ERROR]: Error with loading or training intent data: {e}")
-            self.vectorizer = None
+        super().__init__(data_path, preprocessor, model_dir)
+
+    @property
+    def documents(self):
+        return self.phrases
+
+    def _read_dataset(self, data_path):
+        import pandas as pd # only needed when the compiled model is missing or stale
+        df = pd.read_csv(data_path)
+        df['Subintent'] = df['Subintent'].fillna('none') 
+        phrases = [self._preprocess(p) for p in df['Phrase'].tolist()]
+        return phrases, {'phrases': phrases, 'intents': df['Intent'].tolist(), 'subintents': df['Subintent'].tolist()}
 
+    def _set_tables(self, tables):
+        self.phrases = tables['phrases']
+        self.intents = tables['intents']
+        self.subintents = tables['subintents']
+
+    def _describe(self, i):
+        return self.intents[i], self.subintents[i], self.phrases[i]
+
+    # examples are (phrase, intent, subintent) rows, see TfidfRetriever._append
+    def add_examples(self, examples):
+        return self._append([phrase for phrase, intent, subintent in examples], {
+            'intents': [intent for phrase, intent, subintent in examples],
+            'subintents': [subintent if subintent else 'none' for phrase, intent, subintent in examples]
+        })
+
+    # query can be the raw string or a ProcessedQuery built once per turn
     def classify(self, query, threshold):
-        if self.vectorizer is None:
-            return "SystemError", "none", 0.0
-        processed_query = self._preprocess(query)
-        if not processed_query.strip():
-            return "SystemError", "none", 0.0
-        query_tfidf = self.vectorizer.transform([processed_query])
-        if query_tfidf.sum() == 0:
-            return "Unrecognized", "none", 0.0
-        similarity_scores = cosine_similarity(query_tfidf, self.intent_phrases_tfidf)[0]
-        best_match_index = np.argmax(similarity_scores)
-        best_score = similarity_scores[best_match_index]
-        if best_score >= threshold:
-            return self.intents[best_match_index], self.subintents[best_match_index], best_score
-        else:
-            return "Unrecognized", "none", best_score
\ No newline at end of file
+        labels, scores = self.classify_batch([query], threshold)
+        intent, subintent = labels[0]
+        return intent, subintent, scores[0]
+
+    # returns ([(intent, subintent), ...], scores) with the same decisions classify makes one query at a time
+    def classify_batch(self, queries, threshold):
+        return self._respond_batch(
+            queries, threshold,
+            respond=lambda i: (self.intents[i], self.subintents[i]),
+            error=("SystemError", "none"),
+            no_terms=("Unrecognized", "none"),
+            below_threshold=("Unrecognized", "none")
+        )
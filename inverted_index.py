@@ -0,0 +1,65 @@
+import numpy as np
+from scoring import select_top_k
+
+class InvertedIndex:
+    # term -> postings (row ids sorted, precomputed tf-idf weights) plus each term's max weight for max-score pruning
+    def __init__(self, matrix):
+        postings = matrix.tocsc()
+        postings.sort_indices()
+        self.num_rows = matrix.shape[0]
+        self.indptr = postings.indptr
+        self.rows = postings.indices
+        self.weights = postings.data
+        self.max_weights = np.zeros(matrix.shape[1])
+        non_empty = np.diff(self.indptr) > 0
+        self.max_weights[non_empty] = np.maximum.reduceat(self.weights, self.indptr[:-1][non_empty])
+
+    def _postings(self, term):
+        start, end = self.indptr[term], self.indptr[term + 1]
+        return self.rows[start:end], self.weights[start:end]
+
+    # rows scoring below min_score may be pruned, so only scores >= min_score are guaranteed exact
+    def top_k(self, query_tfidf, k=1, min_score=0.0):
+        query = query_tfidf.tocsr()
+        terms = query.indices
+        query_weights = query.data
+        upper_bounds = query_weights * self.max_weights[terms]
+        order = np.argsort(-upper_bounds, kind='stable')
+        terms, query_weights, upper_bounds = terms[order], query_weights[order], upper_bounds[order]
+        remaining = np.concatenate([np.cumsum(upper_bounds[::-1])[::-1], [0.0]]) # remaining[i]: best a row can still gain from terms i..
+
+        # terms whose tail of upper bounds can't reach min_score on its own are non-essential:
+        # a row that only shows up in them can never qualify, so they never add candidates
+        essential = 0
+        while essential < len(terms) and remaining[essential] >= min_score:
+            essential += 1
+        if essential == 0:
+            return np.array([], dtype=int), np.array([])
+
+        candidate_rows = []
+        candidate_weights = []
+        for i in range(essential):
+            rows, weights = self._postings(terms[i])
+            candidate_rows.append(rows)
+            candidate_weights.append(weights * query_weights[i])
+        candidates, inverse = np.unique(np.concatenate(candidate_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(candidate_weights), minlength=len(candidates))
+
+        for i in range(essential, len(terms)):
+            # partial scores are lower bounds, so the kth best one is a safe cut-off for the rest
+            theta = min_score
+            if len(scores) >= k:
+                theta = max(theta, np.partition(scores, len(scores) - k)[len(scores) - k])
+            alive = scores + remaining[i] >= theta
+            candidates, scores = candidates[alive], scores[alive]
+            if len(candidates) == 0:
+                break
+            rows, weights = self._postings(terms[i])
+            if len(rows) == 0:
+                continue
+            positions = np.searchsorted(rows, candidates)
+            positions[positions == len(rows)] = 0
+            hit = rows[positions] == candidates
+            scores = scores + np.where(hit, weights[positions] * query_weights[i], 0.0)
+
+        return select_top_k(candidates, scores, k)
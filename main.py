@@ -1,13 +1,17 @@
+import queue
+import argparse
+import threading
 import tkinter as tk
 from tkinter import scrolledtext
 from datetime import datetime
 
-from intent_classifier import IntentClassifier
-from small_talk import SmallTalkHandler
-from question_answer import QAHandler
-from identity import IdentityManagement
-from discoverability import Discoverability
-from transaction import EmailHandler, EMAIL_TASK_STATES
+from startup_report import StartupTimer
+from chat_transcript import ChatTranscript
+startup_timer = StartupTimer()
+
+from dialogue_engine import DialogueEngine, DATASET_PATHS
+from dataset_watch import DatasetWatcher
+startup_timer.mark("imports")
 
 BG_COLOR = "#ece5dd"
 CHAT_BG = "#ffffff"
@@ -19,6 +23,8 @@ BUTTON_BG = "#128c7e"
 BUTTON_FG = "#ffffff"
 FONT = ("Helvetica", 11)
 FONT_BOLD = ("Helvetica", 11, "bold")
+HISTORY_LIMIT = 200 # messages kept in the text widget, older ones stay in the transcript
+HISTORY_PAGE_SIZE = 50
 
 class EmailViewer(tk.Toplevel):
     def __init__(self, master, email_data):
@@ -94,30 +100,48 @@ class EmailViewer(tk.Toplevel):
         self.lift()
 
 class ChatbotGUI:
-    def __init__(self, root):
+    def __init__(self, root, fast_start=False, timer=None, startup_report_path=None, unified_index=False, engine=None, history_limit=HISTORY_LIMIT):
         self.root = root
+        self.timer = timer if timer is not None else StartupTimer()
+        self.startup_report_path = startup_report_path
         self.root.title("Maila Chatbot")
         self.root.geometry("420x600")
         self.root.configure(bg=BG_COLOR)
-        self.username = None
-        self.session_id = None
-        self.email_address = None
-        self.chat_stack = ["normal"]
-        self.IDENTITY_TASK_STATES = {"awaiting_name", "awaiting_name_confirm"}
-        self.DISCOVER_TASK_STATES = {"general_help_loop", "capabilities_help"}
-        self.EMAIL_TASK_STATES = set(EMAIL_TASK_STATES)
-        self.intent_classifier = IntentClassifier()
-        self.small_talk_handler = SmallTalkHandler()
-        self.qa_handler = QAHandler()
-        self.identity_handler = IdentityManagement()
-        self.discoverability_handler = Discoverability()
-        self.email_handler = EmailHandler()
-        self.create_widgets()
+        self.awaiting_first_response = False
+        self.pending_queries = queue.Queue() # turns run one at a time on the worker, in the order they were sent
+        self.turns_in_flight = 0
+        self.transcript = ChatTranscript()
+        self.history_limit = max(1, history_limit)
+        self.first_shown = 0 # transcript index of the oldest message still in the widget
+        self.paged_in = 0 # messages brought back by "Load earlier messages", kept until the view is back at the bottom
+        if fast_start: # window and classifier first, the rest is built on first use or by the warm-up thread
+            self.create_widgets()
+            self.timer.mark("window")
+            self.engine = engine if engine is not None else DialogueEngine(lazy=True, timer=self.timer, unified_index=unified_index)
+            self.root.after_idle(self.engine.start_warm_up)
+        else:
+            self.engine = engine if engine is not None else DialogueEngine(timer=self.timer, unified_index=unified_index)
+            self.create_widgets()
+            self.timer.mark("window")
+        self.session = self.engine.new_session()
+        self.engine.on_reload = self._on_reload
+        self.worker = threading.Thread(target=self._turn_worker, name="maila-turns", daemon=True)
+        self.worker.start()
         self.add_chat_message("Hello! I am Maila, let's chat!", "bot")
 
     def create_widgets(self):
         self.chat_frame = tk.Frame(self.root, bg=CHAT_BG, bd=0)
         self.chat_frame.pack(padx=8, pady=8, fill=tk.BOTH, expand=True)
+        self.load_earlier_button = tk.Button(
+            self.chat_frame,
+            text="Load earlier messages",
+            font=("Helvetica", 9),
+            bg=CHAT_BG,
+            fg=BUTTON_BG,
+            relief=tk.FLAT,
+            activebackground=BG_COLOR,
+            command=self.load_earlier_messages
+        )
         self.chat_history = scrolledtext.ScrolledText(
             self.chat_frame,
             wrap=tk.WORD,
@@ -136,6 +160,7 @@ class ChatbotGUI:
         self.chat_history.tag_configure("bot_name", justify='left', font=FONT_BOLD, foreground="#000000", spacing1=6, spacing3=2)
         self.chat_history.tag_configure("timestamp_right", justify='right', foreground=TIME_COLOR, font=("Helvetica", 8), spacing1=2, spacing3=6)
         self.chat_history.tag_configure("timestamp_left", justify='left', foreground=TIME_COLOR, font=("Helvetica", 8), spacing1=0, spacing3=6)
+        self.chat_history.tag_configure("typing", justify='left', foreground=TIME_COLOR, font=("Helvetica", 10, "italic"), lmargin1=10, spacing1=6, spacing3=6)
         input_frame = tk.Frame(self.root, bg=BG_COLOR, pady=6)
         input_frame.pack(fill=tk.X, padx=10)
         self.user_input = tk.Entry(
@@ -169,128 +194,152 @@ class ChatbotGUI:
         if not query:
             return
         self.user_input.delete(0, tk.END)
+        if not self.timer.reported:
+            self.awaiting_first_response = True
+        self.turns_in_flight += 1
         self.add_chat_message(query, "user")
-        self.root.after(200, self.get_bot_response, query) # makes it realistic I guess?
+        self.pending_queries.put(query)
 
-    def add_chat_message(self, message, sender):
-        self.chat_history.config(state=tk.NORMAL)
-        timestamp = datetime.now().strftime("%H:%M")
+    # handler calls can sit on the mail api for seconds, so they run here and only the result touches tk
+    def _turn_worker(self):
+        while True:
+            query = self.pending_queries.get()
+            try:
+                response, action_data = self.engine.handle(self.session, query)
+            except Exception as e:
+                print(f"[GUI ERROR] Turn failed: {e}")
+                response, action_data = "Sorry, something went wrong while handling that. Please try again.", None
+            try:
+                self.root.after_idle(self.deliver_bot_response, response, action_data)
+            except (RuntimeError, tk.TclError): # window already closed
+                return
+
+    # runs on the reload thread, so the notice is handed to tk like a turn result
+    def _on_reload(self, result):
+        if result['ok']:
+            notice = f"The datasets were reloaded in {result['took_ms'] / 1000:.1f}s, new answers use them from now on."
+        else:
+            notice = f"Reloading the datasets failed after {result['took_ms'] / 1000:.1f}s, so I'm still using the previous models. ({result['error']})"
+        try:
+            self.root.after_idle(self.add_chat_message, notice, "bot")
+        except (RuntimeError, tk.TclError):
+            pass
+
+    def _show_typing(self):
+        self.chat_history.insert(tk.END, "Maila is typing\u2026\n", "typing")
+
+    def _hide_typing(self):
+        ranges = self.chat_history.tag_ranges("typing")
+        if ranges:
+            self.chat_history.delete(ranges[0], ranges[-1])
+
+    def _render_message(self, index, position=tk.END):
+        sender, name, message, timestamp = self.transcript[index]
+        tag = f"msg{index}" # one tag per on-screen message so it can be trimmed as a unit
         if sender == "user":
-            name = self.username.upper() if self.username else "YOU"
-            self.chat_history.insert(tk.END, f"{name}\n", "user_name")
-            self.chat_history.insert(tk.END, f"{message}\n", "user_bubble")
-            self.chat_history.insert(tk.END, f"{timestamp}\n", "timestamp_right")
+            self.chat_history.insert(position, f"{name}\n", ("user_name", tag), f"{message}\n", ("user_bubble", tag), f"{timestamp}\n", ("timestamp_right", tag))
         else:
-            self.chat_history.insert(tk.END, "MAILA\n", "bot_name")
-            self.chat_history.insert(tk.END, f"{message}\n", "bot_bubble")
-            self.chat_history.insert(tk.END, f"{timestamp}\n", "timestamp_left")
-        self.chat_history.config(state=tk.DISABLED)
-        self.chat_history.see(tk.END)
+            self.chat_history.insert(position, f"{name}\n", ("bot_name", tag), f"{message}\n", ("bot_bubble", tag), f"{timestamp}\n", ("timestamp_left", tag))
 
-    # generally, we want to the pop the entire group if the chain is completed
-    def manage_state(self, new_state):
-            current_state = self.chat_stack[-1]
-            if new_state == "normal":
-                if current_state in self.IDENTITY_TASK_STATES:
-                    while self.chat_stack and self.chat_stack[-1] in self.IDENTITY_TASK_STATES:
-                        self.chat_stack.pop()
-                elif current_state in self.DISCOVER_TASK_STATES:
-                    while self.chat_stack and self.chat_stack[-1] in self.DISCOVER_TASK_STATES:
-                        self.chat_stack.pop()
-                elif current_state in self.EMAIL_TASK_STATES:
-                    while self.chat_stack and self.chat_stack[-1] in self.EMAIL_TASK_STATES:
-                        self.chat_stack.pop()      
-                elif len(self.chat_stack) > 1:
-                    self.chat_stack.pop()
-            elif new_state != current_state:
-                self.chat_stack.append(new_state)
+    # drops the oldest rendered messages so the widget never holds more than history_limit of them;
+    # nothing is dropped while the user is reading pages they loaded back in
+    def _trim_history(self):
+        while not self.paged_in and len(self.transcript) - self.first_shown > self.history_limit:
+            tag = f"msg{self.first_shown}"
+            ranges = self.chat_history.tag_ranges(tag)
+            if ranges:
+                self.chat_history.delete(ranges[0], ranges[-1])
+            self.chat_history.tag_delete(tag)
+            self.first_shown += 1
+        self._update_load_earlier()
 
-    def get_bot_response(self, query):
-        current_state = self.chat_stack[-1]
-        response = ""
-        action_data = None
+    def _update_load_earlier(self):
+        if self.first_shown > 0:
+            self.load_earlier_button.config(text=f"Load earlier messages ({self.first_shown})")
+            if not self.load_earlier_button.winfo_manager():
+                self.load_earlier_button.pack(side=tk.TOP, fill=tk.X, before=self.chat_history)
+        elif self.load_earlier_button.winfo_manager():
+            self.load_earlier_button.pack_forget()
 
-        if query.lower() == "cancel":
-            if current_state in self.IDENTITY_TASK_STATES:
-                while self.chat_stack and self.chat_stack[-1] in self.IDENTITY_TASK_STATES:
-                    self.chat_stack.pop()
-                response = f"I've cancelled the identity task. We are now in the '{self.chat_stack[-1]}' state."
-            elif current_state in self.DISCOVER_TASK_STATES:
-                while self.chat_stack and self.chat_stack[-1] in self.DISCOVER_TASK_STATES:
-                    self.chat_stack.pop()
-                response = f"I've cancelled the help task. We are now in the '{self.chat_stack[-1]}' state."
-            elif current_state in self.EMAIL_TASK_STATES:
-                while self.chat_stack and self.chat_stack[-1] in self.EMAIL_TASK_STATES:
-                    self.chat_stack.pop()
-            elif len(self.chat_stack) > 1:
-                self.chat_stack.pop()
-                response = f"I've cancelled the ongoing action. We are now in the '{self.chat_stack[-1]}' state. What now?"
-            else:
-                response = "There is no ongoing action to cancel."
-            self.add_chat_message(response, "bot")
-            return
-        elif query.lower() == "go back":
-            if len(self.chat_stack) > 1:
-                self.chat_stack.pop()
-                response = f"Okay, I've gone back one step. We are now in the '{self.chat_stack[-1]}' state."
-            else:
-                response = "There's nothing to go back to."
-            self.add_chat_message(response, "bot")
-            return
-        elif query.lower() == "where am i" or query.lower() == "where am i?":
-            response = f"The chatbot is currently in the '{current_state}' state."
-            self.add_chat_message(response, "bot")
+    def load_earlier_messages(self):
+        if self.first_shown == 0:
             return
-        # TODO add command 'what now' to explain what the user can do now (especially for the email actions)
-        # TODO add command 'repeat' to repeat the bot response to the initiation of the ongoing action (useful in 'go back' cases)
-
-        intent, subintent, score = self.intent_classifier.classify(query, threshold=0.2)
+        previous_first = self.first_shown
+        start = max(0, previous_first - HISTORY_PAGE_SIZE)
+        self.chat_history.config(state=tk.NORMAL)
+        for index in range(previous_first - 1, start - 1, -1):
+            self._render_message(index, "1.0")
+        self.chat_history.config(state=tk.DISABLED)
+        self.paged_in += previous_first - start
+        self.first_shown = start
+        self._update_load_earlier()
+        self.chat_history.see(f"msg{previous_first}.first")
 
-        # Play with the order here to allow certain things mid-action
-        if current_state in self.IDENTITY_TASK_STATES: # Always want this handled first, I don't want users initiating anything else during this
-            response_text, new_name, new_state = self.identity_handler.get_identity_response(query, self.username, subintent="none", current_state=current_state)
-            self.username = new_name
-            self.manage_state(new_state)
-            response = response_text
-        elif intent == "IdentityManagement":
-            response_text, new_name, new_state = self.identity_handler.get_identity_response(query, self.username, subintent=subintent, current_state=current_state)
-            self.username = new_name
-            self.manage_state(new_state)
-            response = response_text
-        elif current_state in self.DISCOVER_TASK_STATES: # I think this makes sense to put here, but keep discovery initialization low
-            response_text, new_state = self.discoverability_handler.get_discoverability_response(query, subintent="none", current_state=current_state)
-            self.manage_state(new_state)
-            response = response_text
-        elif intent == "SmallTalk":
-            raw_response = self.small_talk_handler.get_small_talk_response(query, threshold=0.4)
-            if "{username}" in raw_response:
-                name_to_insert = self.username if self.username else "friend"
-                response = raw_response.replace("{username}", name_to_insert)
-            else:
-                response = raw_response
-        elif intent == "QuestionAnswering":
-            response = self.qa_handler.get_QA_response(query, threshold=0.65)
-        elif intent == "Email" or current_state in self.EMAIL_TASK_STATES:
-            new_state, response_text, session_data, action_data = self.email_handler.handle_email_task(current_state, subintent, query, self.session_id)
-            if session_data is not None:
-                self.session_id, self.email_address = session_data
-            self.manage_state(new_state if new_state else "normal")
-            response = response_text
-            if action_data:
-                if action_data['action'] == 'view_email':
-                    EmailViewer(self.root, action_data['data'])
-        elif intent == "Discoverability":
-            response_text, new_state = self.discoverability_handler.get_discoverability_response(query, subintent=subintent, current_state=current_state)
-            self.manage_state(new_state)
-            response = response_text
+    def add_chat_message(self, message, sender):
+        timestamp = datetime.now().strftime("%H:%M")
+        if sender == "user":
+            name = self.session.username.upper() if self.session.username else "YOU"
         else:
-            if intent == "Unrecognized":
-                response = "Forgive me, but I'm unable to recognize what you are saying."
-            else:
-                response = "[SYSTEM ERROR]: An internal classification error occurred."
+            name = "MAILA"
+        index = self.transcript.append(sender, name, message, timestamp)
+        if self.paged_in and self.chat_history.yview()[1] >= 1.0: # back at the bottom, the paged in messages can go
+            self.paged_in = 0
+        self.chat_history.config(state=tk.NORMAL)
+        self._hide_typing()
+        self._render_message(index)
+        self._trim_history()
+        if self.turns_in_flight:
+            self._show_typing()
+        self.chat_history.config(state=tk.DISABLED)
+        if sender == "user" or not self.paged_in: # don't pull someone reading older pages away from them for a reply
+            self.chat_history.see(tk.END)
+        if sender == "bot" and self.awaiting_first_response:
+            self.awaiting_first_response = False
+            self.timer.mark("first_response")
+            self.timer.report(self.startup_report_path)
+
+    def deliver_bot_response(self, response, action_data):
+        self.turns_in_flight -= 1
+        if action_data:
+            if action_data['action'] == 'view_email':
+                EmailViewer(self.root, action_data['data'])
         self.add_chat_message(response, "bot")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maila chatbot")
+    parser.add_argument("--fast-start", action="store_true", help="show the window as soon as the intent classifier is ready and build the other handlers lazily")
+    parser.add_argument("--startup-report", metavar="PATH", help="append the startup timings (including time to first response) to PATH as a json line")
+    parser.add_argument("--unified-index", action="store_true", help="serve intents, small talk and QA from one shared vocabulary and one transform per turn")
+    parser.add_argument("--serve", action="store_true", help="run headless as a json http/websocket server instead of opening the window")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on with --serve")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on with --serve")
+    parser.add_argument("--operator-commands", action="store_true", help="with --serve, let remote users run the 'stats' and 'reload' commands and read GET /stats (the window always allows them)")
+    parser.add_argument("--mail-api-url", metavar="URL", help="send Guerrilla Mail calls to URL instead of the live service, e.g. a guerrilla_standin.py instance")
+    parser.add_argument("--metrics", action="store_true", help="record per-stage latency histograms, shown by the 'stats' command (and GET /stats with --serve --operator-commands)")
+    parser.add_argument("--preprocess", choices=["nltk", "fast"], help="'fast' swaps per-query pos tagging for a regex tokenizer and a lemma table built from the datasets (default: nltk, or MAILA_PREPROCESS)")
+    parser.add_argument("--watch-datasets", action="store_true", help="rebuild the models in the background whenever a csv under datasets/ changes (the 'reload' command does it on demand)")
+    parser.add_argument("--history-limit", type=int, default=HISTORY_LIMIT, help="messages kept on screen before older ones move to the scrollback")
+    args = parser.parse_args()
+    if args.metrics:
+        from metrics import metrics
+        metrics.enabled = True
+    if args.preprocess:
+        import preprocessing
+        preprocessing.PREPROCESS_MODE = args.preprocess
+    if args.mail_api_url:
+        from guerrilla_mail import GuerrillaSession
+        GuerrillaSession.API_URL = args.mail_api_url
+    if args.serve:
+        from chat_server import run_server
+        engine = DialogueEngine(lazy=args.fast_start, timer=startup_timer, unified_index=args.unified_index, operator_commands=args.operator_commands)
+        if args.fast_start:
+            engine.start_warm_up()
+        if args.watch_datasets:
+            DatasetWatcher(DATASET_PATHS, engine.reload_models).start()
+        run_server(engine, args.host, args.port)
+        raise SystemExit(0)
     root = tk.Tk()
-    app = ChatbotGUI(root)
+    app = ChatbotGUI(root, fast_start=args.fast_start, timer=startup_timer, startup_report_path=args.startup_report, unified_index=args.unified_index, history_limit=args.history_limit)
+    if args.watch_datasets:
+        DatasetWatcher(DATASET_PATHS, app.engine.reload_models).start()
     root.mainloop()
\ No newline at end of file
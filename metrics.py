@@ -0,0 +1,154 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+
+# bucket upper bounds in ms, doubling from 10 us to roughly 80 s
+BUCKET_BOUNDS_MS = [0.01 * (2 ** i) for i in range(24)]
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, ms):
+        self.counts[bisect_left(BUCKET_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.min = ms if self.min is None or ms < self.min else self.min
+        self.max = ms if self.max is None or ms > self.max else self.max
+
+    # upper bound of the bucket holding the q-th observation, so percentiles are at most 2x high, never low
+    def percentile(self, q):
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(BUCKET_BOUNDS_MS[i], self.max) if i < len(BUCKET_BOUNDS_MS) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count, 3) if self.count else None,
+            'min_ms': round(self.min, 3) if self.min is not None else None,
+            'max_ms': round(self.max, 3) if self.max is not None else None,
+            'p50_ms': round(self.percentile(50), 3) if self.count else None,
+            'p95_ms': round(self.percentile(95), 3) if self.count else None,
+            'p99_ms': round(self.percentile(99), 3) if self.count else None,
+        }
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ('metrics', 'name', 'started')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, (time.perf_counter() - self.started) * 1000)
+        if exc_type is not None:
+            self.metrics.incr(self.name + ".errors")
+        return False
+
+class Metrics:
+    # in-process latency histograms and counters; while disabled, span() hands back a shared no-op
+    # and observe()/incr() return after one attribute check, so instrumented code pays next to nothing
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def span(self, name):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name)
+
+    def observe(self, name, ms):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(ms)
+
+    # handlers already collect {'transform_ms': ..., 'product_ms': ...} per call; this files them under prefix
+    def observe_timings(self, prefix, timings):
+        if not self.enabled:
+            return
+        for key, ms in timings.items():
+            self.observe(f"{prefix}.{key[:-3] if key.endswith('_ms') else key}", ms)
+
+    def incr(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    # gauges are read when a snapshot is taken, e.g. cache or registry stats() methods
+    def register_gauge(self, name, read):
+        with self._lock:
+            self._gauges[name] = read
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def snapshot(self):
+        with self._lock:
+            histograms = {name: histogram.snapshot() for name, histogram in sorted(self._histograms.items())}
+            counters = dict(sorted(self._counters.items()))
+            gauges = dict(self._gauges)
+        values = {}
+        for name, read in sorted(gauges.items()):
+            try:
+                values[name] = read()
+            except Exception as e:
+                values[name] = {'error': str(e)}
+        return {'enabled': self.enabled, 'histograms': histograms, 'counters': counters, 'gauges': values}
+
+    def format_report(self):
+        snapshot = self.snapshot()
+        if not self.enabled:
+            lines = ["Stats collection is off. Start Maila with --metrics (or MAILA_METRICS=1) to turn it on."]
+        elif not snapshot['histograms'] and not snapshot['counters']:
+            lines = ["No stats recorded yet."]
+        else:
+            lines = ["Latency (ms): count / p50 / p95 / p99 / max"]
+            for name, h in snapshot['histograms'].items():
+                lines.append(f"  {name}: {h['count']} / {h['p50_ms']:.2f} / {h['p95_ms']:.2f} / {h['p99_ms']:.2f} / {h['max_ms']:.2f}")
+            if snapshot['counters']:
+                lines.append("Counters:")
+                lines += [f"  {name}: {value}" for name, value in snapshot['counters'].items()]
+        for name, value in snapshot['gauges'].items():
+            lines.append(f"{name}: {value}")
+        return "\n".join(lines)
+
+metrics = Metrics(enabled=os.environ.get("MAILA_METRICS", "") not in ("", "0"))
@@ -0,0 +1,91 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+import sklearn
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+MODEL_DIR = "models"
+ARTIFACT_VERSION = 1
+
+class CompiledModel:
+    def __init__(self, vectorizer, matrix, tables, key):
+        self.vectorizer = vectorizer
+        self.matrix = matrix
+        self.tables = tables
+        self.key = key
+
+# data_path may also be a list of csvs for models built over several datasets
+def dataset_key(data_path, config):
+    digest = hashlib.sha256()
+    for path in ([data_path] if isinstance(data_path, str) else data_path):
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+    config = dict(config, artifact_version=ARTIFACT_VERSION, sklearn=sklearn.__version__)
+    digest.update(json.dumps(config, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def artifact_path(name, model_dir=MODEL_DIR):
+    return os.path.join(model_dir, f"{name}.npz")
+
+def save_model(name, model, model_dir=MODEL_DIR):
+    os.makedirs(model_dir, exist_ok=True)
+    vocabulary = model.vectorizer.vocabulary_
+    terms = sorted(vocabulary, key=vocabulary.get)
+    matrix = model.matrix.tocsr()
+    path = artifact_path(name, model_dir)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=model_dir) # one per writer, several workers may rebuild at once
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(
+                f,
+                key=np.array(model.key),
+                terms=np.array(terms, dtype=str),
+                idf=model.vectorizer.idf_,
+                data=matrix.data,
+                indices=matrix.indices,
+                indptr=matrix.indptr,
+                shape=np.array(matrix.shape),
+                tables=np.array(json.dumps(model.tables))
+            )
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path) # never leave a half written artifact behind
+
+def load_model(name, key, vectorizer_params, model_dir=MODEL_DIR):
+    path = artifact_path(name, model_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as artifact:
+            if str(artifact['key']) != key:
+                return None
+            vectorizer = TfidfVectorizer(**vectorizer_params)
+            vectorizer.vocabulary_ = {term: i for i, term in enumerate(artifact['terms'].tolist())}
+            vectorizer.idf_ = artifact['idf']
+            matrix = csr_matrix((artifact['data'], artifact['indices'], artifact['indptr']), shape=tuple(artifact['shape']))
+            tables = json.loads(str(artifact['tables']))
+    except Exception as e:
+        print(f"[SYSTEM ERROR]: Ignoring unreadable model artifact {path}: {e}")
+        return None
+    return CompiledModel(vectorizer, matrix, tables, key)
+
+# build_tables(data_path) returns (preprocessed documents, {column: values}) and is only called on a cache miss
+def load_or_build(name, data_path, vectorizer_params, preprocess_config, build_tables, model_dir=MODEL_DIR):
+    key = dataset_key(data_path, {'vectorizer': vectorizer_params, 'preprocess': preprocess_config})
+    model = load_model(name, key, vectorizer_params, model_dir)
+    if model is not None:
+        return model
+    documents, tables = build_tables(data_path)
+    vectorizer = TfidfVectorizer(**vectorizer_params)
+    matrix = vectorizer.fit_transform(documents)
+    model = CompiledModel(vectorizer, matrix, tables, key)
+    try:
+        save_model(name, model, model_dir)
+    except OSError as e:
+        print(f"[SYSTEM ERROR]: Could not write model artifact for {name}: {e}")
+    return model
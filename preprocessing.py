@@ -0,0 +1,201 @@
+import os
+import re
+import json
+import nltk
+import tempfile
+from collections import Counter, OrderedDict
+from threading import Lock
+from nltk.stem import WordNetLemmatizer
+from metrics import metrics
+from model_store import dataset_key, MODEL_DIR
+
+pos_map = {'ADJ': 'a', 'ADV': 'r', 'NOUN': 'n', 'VERB': 'v'}
+PREPROCESS_VERSION = 3 # bump whenever the pipeline output changes so compiled models get rebuilt
+PREPROCESS_MODES = ("nltk", "fast")
+PREPROCESS_MODE = os.environ.get("MAILA_PREPROCESS", "nltk") # used by the shared preprocessor, main.py sets it from --preprocess
+
+# the fast tokenizer follows word_tokenize (punkt sentences, then NLTKWordTokenizer on each) as far as the isalnum()
+# filter can tell: text is cut where it would put a space, a period followed by whitespace or the end of the text
+# ends a sentence (punkt's abbreviations aside), then an opening quote and a trailing clitic ("'s", "n't", a closing
+# "'") come off each chunk and fused forms ("cannot", "gonna") are split. Chunks still holding a "." "," "-" "_"
+# or a mid-word apostrophe ("3.5", "1,000", "o'clock") are dropped whole
+FAST_SEPARATORS = re.compile(r"[\s?!;@#$%&*()\[\]{}<>\"`\u00ab\u00bb\u201c\u201d\u2018\u2019\u201e\u2012-\u2015]+|--|''|\.{2,}|[:,](?!\d)")
+FAST_OPENING_QUOTE = re.compile(r"(?<!\w)'(?!(?:re|ve|ll|m|t|s|d|n)\b)(?=\w)")
+FAST_FINAL_PERIOD = re.compile(r"([^.])\.([\])}>\"']*)(?=\s|$)")
+FAST_CLITIC = re.compile(r"(?<=[^'])(?:'[smd]|'ll|'re|'ve|n't|')$")
+FAST_FUSED = {'cannot': ('can', 'not'), 'gimme': ('gim', 'me'), 'gonna': ('gon', 'na'), 'gotta': ('got', 'ta'), 'lemme': ('lem', 'me'), 'wanna': ('wan', 'na')}
+FAST_CONTRACTIONS = re.compile(r"\b(can)(not)\b|\b(d)('ye)\b|\b(gim)(me)\b|\b(gon)(na)\b|\b(got)(ta)\b|\b(lem)(me)\b|\b(more)('n)\b|\b(wan)(na)$")
+
+def _split_contraction(match):
+    return ' %s ' % ' '.join(part for part in match.groups() if part is not None)
+
+def fast_tokenize(text):
+    if '.' in text:
+        text = FAST_FINAL_PERIOD.sub(r"\1 \2", text)
+    tokens = []
+    for chunk in FAST_SEPARATORS.split(FAST_OPENING_QUOTE.sub("' ", text)):
+        clitic = FAST_CLITIC.search(chunk)
+        if clitic:
+            chunk = chunk[:clitic.start()]
+        if chunk.isalnum():
+            tokens.extend(FAST_FUSED.get(chunk, (chunk,)))
+        else:
+            tokens.extend(token for token in FAST_CONTRACTIONS.sub(_split_contraction, chunk).split() if token.isalnum())
+    return tokens
+
+# training text the fast mode's lemma table is built from, (csv, column) as the handlers read them
+LEMMA_SOURCES = [("datasets/intents_data.csv", "Phrase"), ("datasets/small_talk.csv", "Question"), ("datasets/question_answer.csv", "Question")]
+LEMMA_TABLE_NAME = "lemma_table"
+
+class ProcessedQuery:
+    def __init__(self, raw, tokens):
+        self.raw = raw
+        self.tokens = tokens
+        self.text = ' '.join(tokens)
+        self.features = {} # transformed vectors, keyed by the model that produced them
+
+    def is_empty(self):
+        return not self.text.strip()
+
+# token -> lemma as the full pipeline lemmatizes each token in the training text, the most frequent one when
+# the tag (and so the lemma) depends on context. Kept next to the compiled models, keyed by the csvs' content
+def load_or_build_lemma_table(lemmatizer, sources=LEMMA_SOURCES, model_dir=MODEL_DIR):
+    key = dataset_key([path for path, column in sources], {'lemma_table': PREPROCESS_VERSION})
+    path = os.path.join(model_dir, f"{LEMMA_TABLE_NAME}.json")
+    try:
+        with open(path, encoding='utf-8') as f:
+            stored = json.load(f)
+        if stored['key'] == key:
+            return key, stored['lemmas']
+    except (OSError, ValueError, KeyError):
+        pass
+    import pandas as pd
+    counts = {}
+    for data_path, column in sources:
+        for text in pd.read_csv(data_path)[column].dropna().tolist():
+            tagged = nltk.pos_tag(nltk.word_tokenize(str(text).lower()), tagset='universal')
+            for w, t in tagged:
+                if w.isalnum():
+                    counts.setdefault(w, Counter())[lemmatizer.lemmatize(w, pos=pos_map.get(t, 'n'))] += 1
+    lemmas = {w: lemma_counts.most_common(1)[0][0] for w, lemma_counts in counts.items()}
+    try:
+        os.makedirs(model_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{LEMMA_TABLE_NAME}.", suffix=".tmp", dir=model_dir) # one per writer, like save_model
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'lemmas': lemmas}, f)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"[SYSTEM ERROR]: Could not write the lemma table: {e}")
+    return key, lemmas
+
+class Preprocessor:
+    # mode "nltk" tags every query in context; "fast" tokenizes with compiled regexes (fast_tokenize) and looks lemmas up in a table built
+    # from the training csvs, tagging only tokens the table has never seen (one at a time, memoised)
+    def __init__(self, memo_size=2048, mode="nltk", model_dir=MODEL_DIR, lemma_sources=LEMMA_SOURCES, fallback_size=8192):
+        if mode not in PREPROCESS_MODES:
+            raise ValueError(f"Unknown preprocessing mode {mode!r}, expected one of {', '.join(PREPROCESS_MODES)}")
+        self.lemmatizer = WordNetLemmatizer()
+        self.mode = mode
+        self.model_dir = model_dir
+        self.lemma_sources = lemma_sources
+        self.memo_size = memo_size
+        self.fallback_size = fallback_size
+        self.lemma_key = None
+        self._lemmas = None
+        self._fallback = OrderedDict()
+        self._memo = OrderedDict()
+        self._lock = Lock()
+
+    # part of every compiled model's key, so switching modes (or a csv change that alters the table) rebuilds them
+    def config(self):
+        if self.mode == "fast":
+            self._refresh_lemma_table()
+            return {'pipeline': 'fast', 'version': PREPROCESS_VERSION, 'lemmas': self.lemma_key}
+        return {'pipeline': 'nltk', 'version': PREPROCESS_VERSION}
+
+    # the preprocessor a model rebuild (a reload) should use: in fast mode a new one, so loading the rebuilt
+    # lemma table doesn't swap it (and clear the memo) under the models still answering with the current one
+    def for_rebuild(self):
+        if self.mode != "fast":
+            return self
+        return Preprocessor(self.memo_size, self.mode, self.model_dir, self.lemma_sources, self.fallback_size)
+
+    def _refresh_lemma_table(self):
+        key, lemmas = load_or_build_lemma_table(self.lemmatizer, self.lemma_sources, self.model_dir)
+        if key != self.lemma_key:
+            with self._lock:
+                self._lemmas = lemmas
+                self.lemma_key = key
+                self._fallback.clear()
+                self._memo.clear() # queries memoised with the old table would tokenize differently
+        return self._lemmas
+
+    def _fallback_lemma(self, token):
+        with self._lock:
+            lemma = self._fallback.get(token)
+            if lemma is not None:
+                self._fallback.move_to_end(token)
+                return lemma
+        metrics.incr("preprocess.lemma_fallbacks")
+        ((w, t),) = nltk.pos_tag([token], tagset='universal')
+        lemma = self.lemmatizer.lemmatize(w, pos=pos_map.get(t, 'n'))
+        with self._lock:
+            self._fallback[token] = lemma
+            while len(self._fallback) > self.fallback_size:
+                self._fallback.popitem(last=False)
+        return lemma
+
+    def _fast_lemmatize_tokens(self, text):
+        lemmas = self._lemmas if self._lemmas is not None else self._refresh_lemma_table()
+        return [lemmas.get(token) or self._fallback_lemma(token) for token in fast_tokenize(text.lower())]
+
+    def lemmatize_tokens(self, text):
+        if self.mode == "fast":
+            return self._fast_lemmatize_tokens(text)
+        tokens = nltk.word_tokenize(text.lower())
+        tagged = nltk.pos_tag(tokens, tagset='universal')
+        return [self.lemmatizer.lemmatize(w, pos=pos_map.get(t, 'n')) for w, t in tagged if w.isalnum()]
+
+    # same pipeline with a span per stage, only taken for user queries while metrics are on
+    def _timed_lemmatize_tokens(self, text):
+        with metrics.span("preprocess.tokenize"):
+            tokens = nltk.word_tokenize(text.lower())
+        with metrics.span("preprocess.pos_tag"):
+            tagged = nltk.pos_tag(tokens, tagset='universal')
+        with metrics.span("preprocess.lemmatize"):
+            return [self.lemmatizer.lemmatize(w, pos=pos_map.get(t, 'n')) for w, t in tagged if w.isalnum()]
+
+    # used for training rows, skips the memo so datasets don't flush out the user's phrases
+    def preprocess(self, text):
+        return ' '.join(self.lemmatize_tokens(text))
+
+    def process(self, query):
+        if isinstance(query, ProcessedQuery):
+            return query
+        with self._lock:
+            cached = self._memo.get(query)
+            if cached is not None:
+                self._memo.move_to_end(query)
+                metrics.incr("preprocess.memo_hits")
+                return cached
+        metrics.incr("preprocess.memo_misses")
+        tokens = self._timed_lemmatize_tokens(query) if metrics.enabled and self.mode == "nltk" else self.lemmatize_tokens(query)
+        processed = ProcessedQuery(query, tokens)
+        with self._lock:
+            self._memo[query] = processed
+            self._memo.move_to_end(query)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return processed
+
+_shared_preprocessor = None
+
+def get_shared_preprocessor():
+    global _shared_preprocessor
+    if _shared_preprocessor is None:
+        _shared_preprocessor = Preprocessor(mode=PREPROCESS_MODE)
+    return _shared_preprocessor
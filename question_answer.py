@@ -1,53 +1,51 @@
-import pandas as pd
-import numpy as np
-import nltk
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from nltk.stem import WordNetLemmatizer
-from nltk.corpus import wordnet
-#from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-
-pos_map = {'ADJ': 'a', 'ADV': 'r', 'NOUN': 'n', 'VERB': 'v'}
-
-class QAHandler:
-    def __init__(self, data_path="datasets/question_answer.csv"):
-        self.lemmatizer = WordNetLemmatizer()
-        self.vectorizer = None
-        self.questions_tfidf = None
+from model_store import MODEL_DIR
+from retrieval import TfidfRetriever
+
+VECTORIZER_PARAMS = {'stop_words': 'english', 'analyzer': 'word'}
+INVERTED_INDEX_MIN_ROWS = 50000 # brute force is cheaper than postings bookkeeping below this
+NO_ANSWER = "I'm afraid I don't have the answer to that."
+
+class QAHandler(TfidfRetriever):
+    vectorizer_params = VECTORIZER_PARAMS
+    metrics_prefix = "qa"
+    load_error = "Error loading QA dataset"
+
+    def __init__(self, data_path="datasets/question_answer.csv", preprocessor=None, model_dir=MODEL_DIR, index_min_rows=INVERTED_INDEX_MIN_ROWS):
         self.questions = []
         self.answers = []
-        self._load_and_train(data_path)
-        
-    def _preprocess(self, text):
-        tokens = nltk.word_tokenize(text.lower())
-        tagged = nltk.pos_tag(tokens, tagset='universal')
-        return ' '.join(self.lemmatizer.lemmatize(w, pos=pos_map.get(t, 'n')) for w, t in tagged if w.isalnum())
-
-    def _load_and_train(self, data_path):
-        try:
-            df = pd.read_csv(data_path)
-            self.questions = [self._preprocess(q) for q in df['Question'].tolist()]
-            self.answers = df['Answer'].tolist()
-            self.vectorizer = TfidfVectorizer(stop_words='english',analyzer='word')
-            self.questions_tfidf = self.vectorizer.fit_transform(self.questions)
-        except Exception as e:
-            print(f"[SYSTEM ERROR]: Error loading QA dataset: {e}")
-            self.vectorizer = None
+        super().__init__(data_path, preprocessor, model_dir, index_min_rows)
+
+    @property
+    def documents(self):
+        return self.questions
+
+    def _read_dataset(self, data_path):
+        import pandas as pd
+        df = pd.read_csv(data_path)
+        questions = [self._preprocess(q) for q in df['Question'].tolist()]
+        return questions, {'questions': questions, 'answers': df['Answer'].tolist()}
+
+    def _set_tables(self, tables):
+        self.questions = tables['questions']
+        self.answers = tables['answers']
+
+    def _describe(self, i):
+        return self.questions[i], self.answers[i]
+
+    # pairs are (question, answer) rows, see TfidfRetriever._append
+    def add_pairs(self, pairs):
+        return self._append([question for question, answer in pairs], {'answers': [answer for question, answer in pairs]})
 
     def get_QA_response(self, query, threshold):
-        if self.questions_tfidf is None or self.vectorizer is None:
-            return "[SYSTEM ERROR]: Error with QA processing"
-        processed_query = self._preprocess(query)
-        if not processed_query.strip():
-            return "[SYSTEM ERROR]: Error with QA processing"
-        query_tfidf = self.vectorizer.transform([processed_query])
-        if query_tfidf.sum() == 0:
-            return "I'm afraid I don't have the answer to that."
-        similarity_scores = cosine_similarity(query_tfidf, self.questions_tfidf)[0]
-        best_match_index = np.argmax(similarity_scores)
-        best_score = similarity_scores[best_match_index]
-        if best_score >= threshold:
-            return f"{self.answers[best_match_index]}"
-        else:
-            return "I'm afraid I don't have the answer to that."
+        answers, scores = self.answer_batch([query], threshold)
+        return answers[0]
+
+    # returns (answers, scores) with the same responses get_QA_response gives one query at a time
+    def answer_batch(self, queries, threshold):
+        return self._respond_batch(
+            queries, threshold,
+            respond=lambda i: f"{self.answers[i]}",
+            error="[SYSTEM ERROR]: Error with QA processing",
+            no_terms=NO_ANSWER,
+            below_threshold=NO_ANSWER
+        )
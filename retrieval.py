@@ -0,0 +1,153 @@
+import os
+import time
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from preprocessing import get_shared_preprocessor
+from model_store import load_or_build, MODEL_DIR
+from scoring import SparseScorer
+from inverted_index import InvertedIndex
+from incremental_index import IncrementalIndex
+from metrics import metrics
+
+class TfidfRetriever:
+    # loading, scoring and batching shared by the csv backed handlers; a subclass reads its rows (_read_dataset,
+    # _set_tables), names the preprocessed text they are matched on (documents) and turns a match into a reply
+    vectorizer_params = {'analyzer': 'word'}
+    metrics_prefix = None
+    load_error = "Error loading dataset"
+
+    def __init__(self, data_path, preprocessor=None, model_dir=MODEL_DIR, index_min_rows=None):
+        self.preprocessor = preprocessor if preprocessor is not None else get_shared_preprocessor()
+        self.model_dir = model_dir
+        self.index_min_rows = index_min_rows # rows from which an InvertedIndex replaces brute force, None for never
+        self.vectorizer = None
+        self.matrix = None
+        self.scorer = None
+        self.index = None
+        self.last_timings = {}
+        self.appended = 0
+        self._load_and_train(data_path)
+
+    @property
+    def documents(self):
+        raise NotImplementedError
+
+    def _preprocess(self, text):
+        return self.preprocessor.preprocess(text)
+
+    # returns (preprocessed documents, {column: values}), only called when the compiled model is missing or stale
+    def _read_dataset(self, data_path):
+        raise NotImplementedError
+
+    def _set_tables(self, tables):
+        raise NotImplementedError
+
+    def _set_matrix(self, matrix):
+        self.matrix = matrix
+        if self.index_min_rows is not None and matrix.shape[0] >= self.index_min_rows:
+            self.index, self.scorer = InvertedIndex(matrix), None
+        else:
+            self.index, self.scorer = None, SparseScorer(matrix)
+
+    # only re-reads and refits the csv when its content hash no longer matches the compiled model
+    def _load_and_train(self, data_path):
+        try:
+            name = os.path.splitext(os.path.basename(data_path))[0]
+            model = load_or_build(name, data_path, self.vectorizer_params, self.preprocessor.config(), self._read_dataset, self.model_dir)
+            self._set_tables(model.tables)
+            self.vectorizer = model.vectorizer
+            self._set_matrix(model.matrix)
+        except Exception as e:
+            print(f"[SYSTEM ERROR]: {self.load_error}: {e}")
+            self.vectorizer = None
+
+    # appends rows in o(new rows): only the new texts are preprocessed, the first append moves the model onto a
+    # hashed IncrementalIndex over the stored documents and later ones just hash the new rows. columns maps each
+    # table attribute to its values for the new rows. Appended rows are kept in memory only, add them to the csv
+    # to keep them across restarts. Like _load_and_train, call it between turns, not while another thread queries
+    def _append(self, texts, columns):
+        if self.vectorizer is None or not texts:
+            return 0
+        documents = [self._preprocess(text) for text in texts]
+        if not isinstance(self.scorer, IncrementalIndex):
+            index = IncrementalIndex(self.vectorizer_params, self.documents)
+            self.index = None # the hashed rows are scored brute force until compact()
+            self.vectorizer = self.scorer = index
+        self.documents.extend(documents)
+        for name, values in columns.items():
+            getattr(self, name).extend(values)
+        self.scorer.add(documents)
+        self.appended += len(documents)
+        return len(documents)
+
+    # folds the appends back into a plain tf-idf model refit over every stored document, no re-tagging needed
+    def compact(self):
+        if not isinstance(self.scorer, IncrementalIndex):
+            return
+        vectorizer = TfidfVectorizer(**self.vectorizer_params)
+        self._set_matrix(vectorizer.fit_transform(self.documents))
+        self.vectorizer = vectorizer
+        self.appended = 0
+
+    # the inverted index may prune rows that can't reach the threshold, so only the decision
+    # (match vs fallback) is guaranteed to match the exhaustive path, not sub-threshold scores
+    def _best_matches(self, queries_tfidf, threshold):
+        if self.index is None:
+            indices, scores, timings = self.scorer.top_k(queries_tfidf, k=1)
+            self.last_timings.update(timings)
+            if indices.shape[1] == 0: # an incremental index with no rows
+                return np.zeros(queries_tfidf.shape[0], dtype=int), np.zeros(queries_tfidf.shape[0])
+            return indices[:, 0], scores[:, 0]
+        started = time.perf_counter()
+        best_indices = np.zeros(queries_tfidf.shape[0], dtype=int)
+        best_scores = np.zeros(queries_tfidf.shape[0])
+        for row in range(queries_tfidf.shape[0]):
+            indices, scores = self.index.top_k(queries_tfidf[row], k=1, min_score=threshold)
+            if len(indices):
+                best_indices[row], best_scores[row] = indices[0], scores[0]
+        self.last_timings['index_ms'] = (time.perf_counter() - started) * 1000
+        return best_indices, best_scores
+
+    # the row a candidate reports, e.g. (question, answer)
+    def _describe(self, i):
+        raise NotImplementedError
+
+    # top k rows for one query, best first, to see what the winner beat (and any ties)
+    def candidates(self, query, k=5):
+        if self.vectorizer is None or (self.scorer is None and self.index is None):
+            return []
+        processed_query = self.preprocessor.process(query).text
+        if not processed_query.strip():
+            return []
+        query_tfidf = self.vectorizer.transform([processed_query])
+        if self.index is not None:
+            row_indices, row_scores = self.index.top_k(query_tfidf, k)
+            indices, scores = [row_indices], [row_scores]
+        else:
+            indices, scores, timings = self.scorer.top_k(query_tfidf, k)
+        return [(*self._describe(i), score) for i, score in zip(indices[0], scores[0])]
+
+    # one reply per query plus its best score: error when nothing is loaded or the query preprocesses to nothing,
+    # no_terms when none of its terms are in the vocabulary, below_threshold or respond(row) otherwise
+    def _respond_batch(self, queries, threshold, respond, error, no_terms, below_threshold):
+        replies = [error] * len(queries)
+        scores = np.zeros(len(queries))
+        if self.vectorizer is None or not queries:
+            return replies, scores
+        processed_queries = [self.preprocessor.process(q).text for q in queries]
+        rows = [i for i, text in enumerate(processed_queries) if text.strip()]
+        if not rows:
+            return replies, scores
+        started = time.perf_counter()
+        queries_tfidf = self.vectorizer.transform([processed_queries[i] for i in rows])
+        self.last_timings = {'transform_ms': (time.perf_counter() - started) * 1000}
+        best_indices, best_scores = self._best_matches(queries_tfidf, threshold)
+        has_terms = np.asarray(queries_tfidf.sum(axis=1)).ravel() != 0
+        for row, i in enumerate(rows):
+            if not has_terms[row]:
+                replies[i] = no_terms
+                continue
+            scores[i] = best_scores[row]
+            replies[i] = respond(best_indices[row]) if best_scores[row] >= threshold else below_threshold
+        metrics.observe_timings(self.metrics_prefix, self.last_timings)
+        return replies, scores
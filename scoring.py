@@ -0,0 +1,43 @@
+import time
+import numpy as np
+
+def select_top_k(row_indices, row_scores, k):
+    if len(row_scores) > k:
+        kth_score = np.partition(row_scores, len(row_scores) - k)[len(row_scores) - k]
+        keep = row_scores >= kth_score # keeps every tie at the cut so the lowest index still wins like argmax
+        row_indices = row_indices[keep]
+        row_scores = row_scores[keep]
+    order = np.lexsort((row_indices, -row_scores))[:k]
+    return row_indices[order], row_scores[order]
+
+class SparseScorer:
+    # rows coming out of TfidfVectorizer are already l2 normalised, so cosine similarity is a plain dot product
+    def __init__(self, matrix):
+        self.num_rows = matrix.shape[0]
+        self.matrix_t = matrix.tocsc().T # term-major (vocab x rows) csr view, no copy per query
+
+    # returns (indices, scores, timings); indices/scores are (n_queries, k), best first, ties broken by lowest row
+    def top_k(self, queries_tfidf, k=1):
+        k = max(1, min(k, self.num_rows))
+        started = time.perf_counter()
+        products = (queries_tfidf @ self.matrix_t).tocsr()
+        product_done = time.perf_counter()
+        indices = np.zeros((products.shape[0], k), dtype=int)
+        scores = np.zeros((products.shape[0], k))
+        for row in range(products.shape[0]):
+            start, end = products.indptr[row], products.indptr[row + 1]
+            row_indices = products.indices[start:end]
+            row_scores = products.data[start:end]
+            positive = row_scores > 0
+            row_indices, row_scores = select_top_k(row_indices[positive], row_scores[positive], k)
+            indices[row, :len(row_indices)] = row_indices
+            scores[row, :len(row_scores)] = row_scores
+            if len(row_indices) < k: # pad like a dense argsort would, with the lowest unused zero-score rows
+                unused = np.setdiff1d(np.arange(min(self.num_rows, k + len(row_indices))), row_indices)[:k - len(row_indices)]
+                indices[row, len(row_indices):] = unused
+        select_done = time.perf_counter()
+        timings = {
+            'product_ms': (product_done - started) * 1000,
+            'select_ms': (select_done - product_done) * 1000
+        }
+        return indices, scores, timings
@@ -0,0 +1,90 @@
+import time
+import threading
+from collections import OrderedDict
+from guerrilla_mail import GuerrillaSession
+
+class RegistryEntry:
+    def __init__(self, session, now):
+        self.session = session
+        self.last_used = now
+        self.validated_at = now
+
+class GuerrillaSessionRegistry:
+    # keeps live GuerrillaSession objects (keep-alive connection pool + cached inbox) keyed by sid,
+    # so a turn only pays the get_email_address round trip when the cached session is older than validate_ttl
+    def __init__(self, max_size=256, idle_timeout=900, validate_ttl=300, session_factory=GuerrillaSession):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.validate_ttl = validate_ttl
+        self.session_factory = session_factory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def _close(self, entry):
+        try:
+            entry.session.session.close()
+        except Exception:
+            pass
+
+    def _evict(self, now):
+        while self._entries:
+            sid, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_size and now - entry.last_used <= self.idle_timeout:
+                break
+            del self._entries[sid]
+            self._close(entry)
+
+    def register(self, session, sid_token=None):
+        sid_token = sid_token or session.sid_token
+        now = time.monotonic()
+        with self._lock:
+            old = self._entries.pop(sid_token, None)
+            if old is not None and old.session is not session:
+                self._close(old)
+            self._entries[sid_token] = RegistryEntry(session, now)
+            self._evict(now)
+        return session
+
+    def get(self, sid_token, revalidate=False):
+        if not sid_token:
+            raise ValueError("Session ID is required to restore.")
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            entry = self._entries.get(sid_token)
+            if entry is not None:
+                self._entries.move_to_end(sid_token)
+                entry.last_used = now
+        if entry is None:
+            self.misses += 1
+            session = self.session_factory()
+            if session.restore_session(sid_token=sid_token): # raises if the sid is invalid or expired
+                self.register(session, sid_token)
+            return session
+        self.hits += 1
+        if revalidate or now - entry.validated_at > self.validate_ttl:
+            self.revalidations += 1
+            try:
+                valid = entry.session.restore_session(sid_token=sid_token)
+            except Exception:
+                self.discard(sid_token)
+                raise
+            if not valid:
+                self.discard(sid_token)
+                return self.session_factory() # blank session, callers see no email_addr and treat it as expired
+            entry.validated_at = time.monotonic()
+        return entry.session
+
+    def discard(self, sid_token):
+        with self._lock:
+            entry = self._entries.pop(sid_token, None)
+        if entry is not None:
+            self._close(entry)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        return {'size': size, 'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations}
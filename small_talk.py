@@ -1,55 +1,55 @@
-import pandas as pd
-import numpy as np
-import nltk
 import random
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from nltk.stem import WordNetLemmatizer
-from nltk.corpus import wordnet
-#from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-
-pos_map = {'ADJ': 'a', 'ADV': 'r', 'NOUN': 'n', 'VERB': 'v'}
-
-class SmallTalkHandler:
-    def __init__(self, data_path="datasets/small_talk.csv"):
-        self.lemmatizer = WordNetLemmatizer()
-        self.vectorizer = None
-        self.questions_tfidf = None
+from model_store import MODEL_DIR
+from retrieval import TfidfRetriever
+
+VECTORIZER_PARAMS = {'analyzer': 'word'}
+PROCESSING_ERROR = "[SYSTEM ERROR]: Error with small talk processing"
+
+class SmallTalkHandler(TfidfRetriever):
+    vectorizer_params = VECTORIZER_PARAMS
+    metrics_prefix = "small_talk"
+    load_error = "Error loading small talk data"
+
+    def __init__(self, data_path="datasets/small_talk.csv", preprocessor=None, model_dir=MODEL_DIR):
         self.questions = []
         self.answers = []
-        self._load_and_train(data_path)
-
-    def _preprocess(self, text):
-        tokens = nltk.word_tokenize(text.lower())
-        tagged = nltk.pos_tag(tokens, tagset='universal')
-        return ' '.join(self.lemmatizer.lemmatize(w, pos=pos_map.get(t, 'n')) for w, t in tagged if w.isalnum())
-
-    def _load_and_train(self, data_path):
-        try:
-            df = pd.read_csv(data_path)
-            self.questions = [self._preprocess(q) for q in df['Question'].tolist()]
-            self.answers = df['Answer'].tolist()
-            self.vectorizer = TfidfVectorizer(analyzer='word')
-            self.questions_tfidf = self.vectorizer.fit_transform(self.questions)
-        except Exception as e:
-            print(f"[SYSTEM ERROR]: Error loading small talk data: {e}")
-            self.vectorizer = None
+        super().__init__(data_path, preprocessor, model_dir)
+
+    @property
+    def documents(self):
+        return self.questions
+
+    def _read_dataset(self, data_path):
+        import pandas as pd
+        df = pd.read_csv(data_path)
+        questions = [self._preprocess(q) for q in df['Question'].tolist()]
+        return questions, {'questions': questions, 'answers': df['Answer'].tolist()}
+
+    def _set_tables(self, tables):
+        self.questions = tables['questions']
+        self.answers = tables['answers']
+
+    def _describe(self, i):
+        return self.questions[i], self.answers[i]
+
+    # pairs are (question, answer) rows, see TfidfRetriever._append
+    def add_pairs(self, pairs):
+        return self._append([question for question, answer in pairs], {'answers': [answer for question, answer in pairs]})
 
     def get_small_talk_response(self, query, threshold):
-        if self.questions_tfidf is None or self.vectorizer is None:
-            return "[SYSTEM ERROR]: Error with small talk processing"
-        processed_query = self._preprocess(query)
-        if not processed_query.strip():
-            return "[SYSTEM ERROR]: Error with small talk processing"
-        query_tfidf = self.vectorizer.transform([processed_query])
-        if query_tfidf.sum() == 0:
-            return "[SYSTEM ERROR]: No match for query within small talk"  
-        similarity_scores = cosine_similarity(query_tfidf, self.questions_tfidf)[0]
-        best_match_index = np.argmax(similarity_scores)
-        best_score = similarity_scores[best_match_index]
-        if best_score >= threshold:
-            responses = [r.strip() for r in self.answers[best_match_index].split("|")]
-            return random.choice(responses)
-        else:
-            return "[SYSTEM ERROR]: Error with small talk processing"
+        answers, scores = self.answer_batch([query], threshold)
+        return answers[0]
+
+    # one of the matched row's "|" separated replies, picked at random
+    def _reply(self, i):
+        return random.choice([r.strip() for r in self.answers[i].split("|")])
+
+    # returns (answers, scores) with the same responses get_small_talk_response gives one query at a time
+    def answer_batch(self, queries, threshold):
+        return self._respond_batch(
+            queries, threshold,
+            respond=self._reply,
+            error=PROCESSING_ERROR,
+            no_terms="[SYSTEM ERROR]: No match for query within small talk",
+            below_threshold=PROCESSING_ERROR
+        )
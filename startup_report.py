@@ -0,0 +1,66 @@
+import time
+import json
+import threading
+
+class StartupTimer:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks = []
+        self.reported = False
+        self._lock = threading.Lock()
+
+    def mark(self, label, started=None):
+        now = time.perf_counter()
+        with self._lock:
+            self.marks.append({
+                'label': label,
+                'at_ms': round((now - self.start) * 1000, 1),
+                'took_ms': round((now - started) * 1000, 1) if started is not None else None,
+                'thread': threading.current_thread().name
+            })
+
+    def report(self, output_path=None):
+        with self._lock:
+            if self.reported:
+                return
+            self.reported = True
+            marks = list(self.marks)
+        for m in marks:
+            took = f" (took {m['took_ms']} ms)" if m['took_ms'] is not None else ""
+            print(f"[STARTUP] {m['label']}: {m['at_ms']} ms{took} [{m['thread']}]")
+        if output_path:
+            # one json line per run so time-to-first-response can be compared across releases
+            try:
+                with open(output_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'marks': marks}) + "\n")
+            except OSError as e:
+                print(f"[SYSTEM ERROR]: Could not write startup report: {e}")
+
+class LazyHandler:
+    def __init__(self, name, factory, timer=None):
+        self.name = name
+        self.factory = factory
+        self.timer = timer
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def built(self):
+        return self._instance is not None
+
+    # first caller builds it, anyone arriving mid-build (e.g. a turn during warm-up) waits for the same instance
+    def get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    started = time.perf_counter()
+                    self._instance = self.factory()
+                    if self.timer:
+                        self.timer.mark(self.name, started)
+        return self._instance
+
+    def warm_up(self):
+        try:
+            self.get()
+        except Exception as e:
+            print(f"[SYSTEM ERROR]: Warm-up of {self.name} failed: {e}")
@@ -2,21 +2,15 @@ import re
 import os
 import random
 from guerrilla_mail import GuerrillaSession
+from session_registry import GuerrillaSessionRegistry
+from circuit_breaker import CircuitOpenError
 from requests.exceptions import RequestException, ConnectionError, HTTPError
 from urllib3.exceptions import NameResolutionError
+from email_states import EMAIL_AWAITING_STATES, EMAIL_LOOP_STATES, EMAIL_TASK_STATES
+from metrics import metrics
+
+ARCHIVE_PATTERN = re.compile(r'\b(?:as|into|in|to)?\s*(?:an?\s+|one\s+)?(mbox|zip|archive)(?:\s+file)?\b', re.IGNORECASE)
 
-EMAIL_AWAITING_STATES = [
-    'awaiting_session_start_confirm',
-    'awaiting_session_restore_confirm',
-    'awaiting_session_restore',
-    'awaiting_session_end_confirm',
-    'awaiting_view_index',
-    'awaiting_delete_index',
-    'awaiting_download_index',
-    'awaiting_delete_all_confirm'
-]
-EMAIL_LOOP_STATES = ['email_manage_loop']
-EMAIL_TASK_STATES = EMAIL_AWAITING_STATES + EMAIL_LOOP_STATES
 
 class EmailResponseGenerator:
     def __init__(self):
@@ -75,7 +69,7 @@ class EmailResponseGenerator:
                 return random.choice(self.templates['inbox_empty'])
             list_text = ""
             for i, email in enumerate(inbox, 1):
-                list_text += f"  {i}. From: {email['mail_from']}, Subject: {email['mail_subject']} (ID: {email['mail_id']})\n"
+                list_text += f"  {i}. From: {email.mail_from}, Subject: {email.mail_subject} (ID: {email.mail_id})\n"
             template = random.choice(self.templates['list_emails'])
             return template.format(list_text=list_text.strip())
         elif intent_type == 'delete_emails':
@@ -91,8 +85,10 @@ class EmailResponseGenerator:
         return "I'm not sure how to phrase that."
 
 class EmailHandler:
-    def __init__(self):
+    def __init__(self, session_registry=None):
         self.responder = EmailResponseGenerator()
+        self.sessions = session_registry if session_registry is not None else GuerrillaSessionRegistry()
+        metrics.register_gauge("session_registry", self.sessions.stats)
 
     def _extract_session_id(self, text):
         match = re.search(r'\b([a-z0-9]{24})\b', text.lower())
@@ -102,6 +98,12 @@ class EmailHandler:
         match = re.search(r'\b(\d+)\b', text.lower())
         return match.group(1) if match else None
 
+    def _extract_archive_format(self, text):
+        match = ARCHIVE_PATTERN.search(text)
+        if not match:
+            return None
+        return 'zip' if match.group(1).lower() == 'zip' else 'mbox'
+
     def _extract_email_indices(self, text, subintent):
         processed_text = text.lower().replace(subintent, "").strip()
         if "all" in processed_text:
@@ -116,9 +118,9 @@ class EmailHandler:
             session.get_inbox_list()
         if index_str.isdigit():
             try:
-                list_index = int(index_str) - 1
-                if 0 <= list_index < len(session.inbox):
-                    return session.inbox[list_index]['mail_id']
+                position = int(index_str)
+                if 1 <= position <= len(session.inbox):
+                    return session.inbox.at(position).mail_id
             except:
                 pass 
         return index_str
@@ -143,6 +145,7 @@ class EmailHandler:
                 session = GuerrillaSession()
                 success = session.start_new_session()
                 if success:
+                    self.sessions.register(session)
                     new_session_id = session.sid_token
                     new_email_address = session.email_addr
                     content = {'type': 'start_session', 'email': new_email_address, 'sid': new_session_id}
@@ -156,8 +159,8 @@ class EmailHandler:
             elif subintent == 'restore_session':
                 provided_id = self._extract_session_id(user_input)
                 if provided_id:
-                    session = GuerrillaSession()
-                    success = session.restore_session(sid_token=provided_id)
+                    session = self.sessions.get(provided_id, revalidate=True)
+                    success = session.email_addr is not None
                     if success:
                         email_address = session.email_addr
                         content = {'type': 'restore_session', 'email': email_address, 'sid': provided_id}
@@ -204,10 +207,10 @@ class EmailHandler:
                 return (new_state, response, None, None)
             elif current_state == 'awaiting_session_end_confirm':
                 if 'yes' in user_input.lower():
-                    session = GuerrillaSession()
-                    session.restore_session(sid_token=session_id)
+                    session = self.sessions.get(session_id)
                     success = session.forget_current_email()
                     if success:
+                        self.sessions.discard(session_id)
                         response = "Your session has been ended and your email address deleted. Let me know if you need a new one."
                         new_session_data = (None, None) 
                     else:
@@ -226,8 +229,8 @@ class EmailHandler:
                     new_state = 'awaiting_view_index'
                 return (new_state, response, None, None) 
             elif current_state == 'awaiting_download_index':
-                indices_str = self._extract_email_indices(user_input, "download")
-                if indices_str:
+                indices_str = self._extract_email_indices(ARCHIVE_PATTERN.sub(' ', user_input), "download")
+                if indices_str or self._extract_archive_format(user_input):
                     return self.handle_email_task('email_manage_loop', 'download_email', user_input, session_id)
                 else:
                     response = "I didn't catch that. Please provide indices (e.g., '1', '1, 2', '1-3', 'all'), or say 'cancel'."
@@ -247,8 +250,7 @@ class EmailHandler:
                 return (new_state, response, None, None)
             elif current_state == 'awaiting_delete_all_confirm':
                 if 'yes' in user_input.lower():
-                    session = GuerrillaSession()
-                    session.restore_session(sid_token=session_id)
+                    session = self.sessions.get(session_id)
                     deleted_ids = session.delete_emails('all')
                     
                     if deleted_ids is not None:
@@ -263,8 +265,7 @@ class EmailHandler:
                 return (new_state, response, None, None)
             
             if session_id:
-                session = GuerrillaSession()
-                session.restore_session(sid_token=session_id) 
+                session = self.sessions.get(session_id)
                 if not session.email_addr:
                     raise Exception("Session expired or is invalid.")
                 if subintent == 'exit_loop':
@@ -292,8 +293,18 @@ class EmailHandler:
                         response = "Which email index would you like to view? Please enter a number."
                         new_state = 'awaiting_view_index'
                 elif subintent == 'download_email':
-                    indices_str = self._extract_email_indices(user_input, subintent)
-                    if indices_str:
+                    archive_format = self._extract_archive_format(user_input)
+                    indices_str = self._extract_email_indices(ARCHIVE_PATTERN.sub(' ', user_input), subintent)
+                    if archive_format:
+                        (archive_path, exported, skipped, failed_files) = session.export_archive(indices_str or 'all', archive_format)
+                        result_text = f"Exported {exported} email(s) to {archive_path}"
+                        if skipped:
+                            result_text += f" ({skipped} were already in the archive)"
+                        if failed_files > 0:
+                            result_text += f". {failed_files} failed, ask again to resume the export"
+                        response = self.responder.generate_response({'type': 'download_emails', 'result_text': result_text})
+                        new_state = 'email_manage_loop'
+                    elif indices_str:
                         (downloaded_files, failed_files) = session.download_emails(indices_str)
                         result_text = f"Successfully downloaded {len(downloaded_files)} email(s)."
                         if failed_files > 0:
@@ -301,7 +312,7 @@ class EmailHandler:
                         response = self.responder.generate_response({'type': 'download_emails', 'result_text': result_text})
                         new_state = 'email_manage_loop'
                     else:
-                        response = "Which email(s) would you like to download? You can enter '1', '1, 2', '1-3', or 'all'."
+                        response = "Which email(s) would you like to download? You can enter '1', '1, 2', '1-3', or 'all', and add 'as archive' or 'as zip' for a single file."
                         new_state = 'awaiting_download_index'
                 elif subintent == 'delete_email':
                     indices_str = self._extract_email_indices(user_input, subintent)
@@ -332,6 +343,10 @@ class EmailHandler:
                 return (new_state, response, new_session_data, action_data)
             pass
 
+        except CircuitOpenError as e:
+            print(f"[TRANSACTION_ERROR] Circuit open: {e}")
+            response = f"The email service has been failing, so I'm holding off on it for about {max(1, round(e.retry_after))} more second(s). Please try again shortly."
+            new_state = current_state
         except (ConnectionError, NameResolutionError) as e:
             print(f"[TRANSACTION_ERROR] Connection error: {e}")
             response = "I'm sorry, I'm having trouble connecting to the email service. Please check your internet connection and try again."
@@ -0,0 +1,148 @@
+import random
+import numpy as np
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+from sklearn.preprocessing import normalize
+from preprocessing import get_shared_preprocessor
+from model_store import load_or_build, MODEL_DIR
+from scoring import SparseScorer
+
+VECTORIZER_PARAMS = {'analyzer': 'word', 'norm': None} # rows are reweighted and normalized per namespace
+NAMESPACES = ['intent', 'small_talk', 'qa']
+DEFAULT_DATA_PATHS = {
+    'intent': "datasets/intents_data.csv",
+    'small_talk': "datasets/small_talk.csv",
+    'qa': "datasets/question_answer.csv"
+}
+STOP_WORD_NAMESPACES = {'qa'} # the standalone QAHandler drops english stop words, so its rows are scored without them
+
+# idf as TfidfVectorizer would fit it on the rows of one namespace alone, 0 for terms none of them contain
+def namespace_idf(matrix):
+    df = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = np.log((1 + matrix.shape[0]) / (1 + df)) + 1
+    idf[df == 0] = 0.0
+    return idf
+
+class UnifiedIndex:
+    # one vocabulary and one transform per query for intent, small talk and QA lookups. Each namespace keeps its
+    # own idf, as a column weight over the shared one, so it scores (and routes) like the separate models do
+    def __init__(self, data_paths=None, preprocessor=None, model_dir=MODEL_DIR):
+        self.preprocessor = preprocessor if preprocessor is not None else get_shared_preprocessor()
+        self.model_dir = model_dir
+        self.data_paths = dict(DEFAULT_DATA_PATHS, **(data_paths or {}))
+        self.vectorizer = None
+        self.key = None
+        self.namespaces = {}
+        self.texts = []
+        self.labels = []
+        self.sublabels = []
+        self.answers = []
+        self._load_and_train()
+
+    def _read_datasets(self, data_paths):
+        import pandas as pd
+        tables = {'namespace': [], 'text': [], 'label': [], 'sublabel': [], 'answer': []}
+        for namespace, data_path in zip(NAMESPACES, data_paths):
+            df = pd.read_csv(data_path)
+            if namespace == 'intent':
+                df['Subintent'] = df['Subintent'].fillna('none')
+                texts = df['Phrase'].tolist()
+                tables['label'] += df['Intent'].tolist()
+                tables['sublabel'] += df['Subintent'].tolist()
+                tables['answer'] += [None] * len(df)
+            else:
+                texts = df['Question'].tolist()
+                tables['label'] += [None] * len(df)
+                tables['sublabel'] += [None] * len(df)
+                tables['answer'] += df['Answer'].tolist()
+            tables['namespace'] += [namespace] * len(df)
+            tables['text'] += [self.preprocessor.preprocess(t) for t in texts]
+        return tables['text'], tables
+
+    def _load_and_train(self):
+        try:
+            data_paths = [self.data_paths[namespace] for namespace in NAMESPACES]
+            model = load_or_build("unified", data_paths, VECTORIZER_PARAMS, self.preprocessor.config(), self._read_datasets, self.model_dir)
+            self.vectorizer = model.vectorizer
+            self.key = model.key
+            self.texts = model.tables['text']
+            self.labels = model.tables['label']
+            self.sublabels = model.tables['sublabel']
+            self.answers = model.tables['answer']
+            vocabulary = self.vectorizer.vocabulary_
+            stop_columns = [i for term, i in vocabulary.items() if term in ENGLISH_STOP_WORDS]
+            namespace_column = np.array(model.tables['namespace'])
+            for namespace in NAMESPACES:
+                rows = np.flatnonzero(namespace_column == namespace) # each dataset is one contiguous block
+                start, end = int(rows[0]), int(rows[-1]) + 1
+                matrix = model.matrix[start:end]
+                idf = namespace_idf(matrix)
+                if namespace in STOP_WORD_NAMESPACES:
+                    idf[stop_columns] = 0.0
+                weights = idf / self.vectorizer.idf_ # swaps the shared idf for the namespace's
+                self.namespaces[namespace] = (start, SparseScorer(self._weigh(matrix, weights)), weights)
+        except Exception as e:
+            print(f"[SYSTEM ERROR]: Error loading unified index: {e}")
+            self.vectorizer = None
+
+    def _weigh(self, matrix, weights):
+        weighted = matrix.multiply(weights).tocsr()
+        weighted.eliminate_zeros()
+        return normalize(weighted)
+
+    def _vector(self, processed_query):
+        query_tfidf = processed_query.features.get(self.key)
+        if query_tfidf is None:
+            query_tfidf = self.vectorizer.transform([processed_query.text])
+            processed_query.features[self.key] = query_tfidf
+        return query_tfidf
+
+    # returns (global row, score, has_terms) for the best row of one namespace, reusing the turn's vector
+    def best_match(self, query, namespace):
+        processed_query = self.preprocessor.process(query)
+        start, scorer, weights = self.namespaces[namespace]
+        query_tfidf = self._weigh(self._vector(processed_query), weights)
+        if query_tfidf.sum() == 0:
+            return None, 0.0, False
+        indices, scores, timings = scorer.top_k(query_tfidf, k=1)
+        return start + int(indices[0, 0]), scores[0, 0], True
+
+    def classify(self, query, threshold):
+        if self.vectorizer is None:
+            return "SystemError", "none", 0.0
+        if self.preprocessor.process(query).is_empty():
+            return "SystemError", "none", 0.0
+        row, score, has_terms = self.best_match(query, 'intent')
+        if not has_terms:
+            return "Unrecognized", "none", 0.0
+        if score >= threshold:
+            return self.labels[row], self.sublabels[row], score
+        return "Unrecognized", "none", score
+
+    def get_small_talk_response(self, query, threshold):
+        if self.vectorizer is None or self.preprocessor.process(query).is_empty():
+            return "[SYSTEM ERROR]: Error with small talk processing"
+        row, score, has_terms = self.best_match(query, 'small_talk')
+        if not has_terms:
+            return "[SYSTEM ERROR]: No match for query within small talk"
+        if score >= threshold:
+            responses = [r.strip() for r in self.answers[row].split("|")]
+            return random.choice(responses)
+        return "[SYSTEM ERROR]: Error with small talk processing"
+
+    def get_QA_response(self, query, threshold):
+        if self.vectorizer is None or self.preprocessor.process(query).is_empty():
+            return "[SYSTEM ERROR]: Error with QA processing"
+        row, score, has_terms = self.best_match(query, 'qa')
+        if has_terms and score >= threshold:
+            return f"{self.answers[row]}"
+        return "I'm afraid I don't have the answer to that."
+
+    # intent decision and the candidate answer from one transform of the query
+    def lookup(self, query, intent_threshold, small_talk_threshold=0.4, qa_threshold=0.65):
+        intent, subintent, score = self.classify(query, intent_threshold)
+        answer = None
+        if intent == "SmallTalk":
+            answer = self.get_small_talk_response(query, small_talk_threshold)
+        elif intent == "QuestionAnswering":
+            answer = self.get_QA_response(query, qa_threshold)
+        return intent, subintent, score, answer